@@ -0,0 +1,331 @@
+#!/usr/bin/python3
+
+##
+# file benchmark.py
+# brief Throughput benchmarks for syr2ipa on a generated reference corpus
+#
+# Every scenario generates the same seeded synthetic corpus on each run, so
+# results saved with --json can be compared across commits with --compare.
+##
+
+import gc
+import os
+import json
+import time
+import random
+import argparse
+import platform
+import subprocess
+import tracemalloc
+
+import syr2ipa
+
+SAMPLE = 'ܘܟܠܹܐܠܹܗ ܥܲܠ ܣܹܠܵܐ ܕܝܵܡܵܐ. ܘܚܙܹܠܝܼ ܕܐ݇ܣܸܩܠܹܗ ܕܵܒܵܐ ܡ̣ܢ ܝܵܡܵܐ؛ Assyrian 2021\n'
+
+Scenarios = ('plain', 'diacritized', 'mixed', 'bdol')
+Stages = ('clean', 'bdol', 'lookup', 'tokenize', 'render', 'clusters')
+
+LatinWords = ['the', 'Assyrian', 'church', 'of', 'the', 'East', '2021', 'Urmia', 'and', 'Nineveh', '(1915)', 'e.g.', 'ISBN', '978-0']
+BdolLetters = ['ܒ', 'ܕ', 'ܘ', 'ܠ']
+
+##
+# The lookup StrToSyrChars used before the compiled table: a scan of every
+# defined character per input codepoint, kept here as the baseline.
+def StrToSyrCharsLinear(word):
+    thisChar = None
+    syrChars = []
+    for char in word:
+        for syrChar in syr2ipa.SyrChars:
+            if char == syrChar.character:
+                thisChar = syrChar
+        if thisChar is None:
+            thisChar = syr2ipa.SyrChar('NON-SYR-CHAR', char)
+        syrChars.append(thisChar)
+        thisChar = None
+
+    return syrChars
+
+def CharsPerSecond(lookup, text, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        lookup(text)
+    elapsed = time.perf_counter() - start
+    return len(text) * repeat / elapsed
+
+##
+# Generates the words of a synthetic corpus for a scenario.
+#
+# plain:       letters, most of them vowelled, the odd rukakha or qanuna
+# diacritized: every letter vowelled and most of them marked
+# mixed:       plain Syriac words with latin words, numbers and punctuation
+# bdol:        plain words, half of them behind a BDOL prefix letter
+#
+# Returns the words and, for bdol, a dictionary of the unprefixed words.
+def GenerateCorpus(scenario, n_words, seed):
+    rng = random.Random(seed)
+    syrChars = syr2ipa.DefaultScheme.syrChars
+    letters = [c.character for c in syrChars if c.is_letter and c.character not in ('ܖ', 'ܤ')]
+    vowels = [c.character for c in syrChars if c.is_vowel and c.character in syr2ipa.WordKeyVowels]
+    marks = [c.character for c in syrChars if c.is_modifer or c.is_qanuna or c.is_siyameh or c.is_talqana]
+    punctuation = [c.character for c in syrChars if c.is_punctuation] + ['.', ',']
+
+    vowelRate, markRate = (0.95, 0.6) if scenario == 'diacritized' else (0.55, 0.05)
+
+    def Word():
+        word = ''
+        for _ in range(rng.randint(2, 7)):
+            word += rng.choice(letters)
+            if rng.random() < markRate:
+                word += rng.choice(marks)
+            if rng.random() < vowelRate:
+                word += rng.choice(vowels)
+        return word
+
+    # a vocabulary with a long tail, like running text
+    vocabulary = [Word() for _ in range(max(n_words // 8, 1))]
+    words = []
+    dictionary = None
+    for _ in range(n_words):
+        word = vocabulary[min(int(rng.paretovariate(1.0)) - 1, len(vocabulary) - 1)] if rng.random() < 0.7 else Word()
+        if scenario == 'mixed':
+            if rng.random() < 0.35:
+                word = rng.choice(LatinWords)
+            elif rng.random() < 0.15:
+                word += rng.choice(punctuation)
+        words.append(word)
+
+    if scenario == 'bdol':
+        dictionary = {syr2ipa.CleanUpWord(word): 1 for word in vocabulary}
+        words = [rng.choice(BdolLetters) + word if rng.random() < 0.5 else word for word in words]
+
+    return words, dictionary
+
+##
+# Words of random characters of the scheme, with a few others mixed in, in
+# orders no real text has: marks with no letter, marks after punctuation or
+# latin letters, repeated and conflicting marks.
+def GenerateNoise(n_words, seed, scheme=None):
+    rng = random.Random(seed)
+    chars = list((scheme or syr2ipa.DefaultScheme).charTable) + list("a1.'-é")
+    return [''.join(rng.choice(chars) for _ in range(rng.randint(1, 9))) for _ in range(n_words)]
+
+##
+# Renders every word both through the cluster fast path and token by token,
+# in every output mode, returning the (word, mode, tokens, clusters) of each
+# difference.
+def VerifyFastPath(words, scheme=None):
+    scheme = scheme or syr2ipa.DefaultScheme
+    differences = []
+    for word in words:
+        tokens = syr2ipa.TokenizeLettersWithModifiers(syr2ipa.StrToSyrChars(word, scheme))
+        clusters = scheme.clusterRuns.findall(word)
+        for mode in syr2ipa.OutputModes:
+            expected = syr2ipa.SyrCharTokensToOutput(tokens, mode, scheme)
+            output = syr2ipa.SyrClustersToOutput(clusters, mode, scheme)
+            if output != expected:
+                differences.append((word, mode, expected, output))
+    return differences
+
+##
+# Joins corpus words into lines of running text.
+def CorpusText(words, seed):
+    rng = random.Random(seed)
+    lines = []
+    start = 0
+    while start < len(words):
+        end = start + rng.randint(6, 16)
+        lines.append(' '.join(words[start:end]))
+        start = end
+    return '\n'.join(lines) + '\n'
+
+##
+# The fastest of repeat runs of function. Like timeit, the garbage collector
+# is paused while timing, so stages that hold every token of the corpus are
+# not charged for collections that streaming never triggers.
+def BestTime(function, repeat):
+    best = None
+    for _ in range(repeat):
+        gcWasEnabled = gc.isenabled()
+        gc.disable()
+        try:
+            start = time.perf_counter()
+            function()
+            elapsed = time.perf_counter() - start
+        finally:
+            if gcWasEnabled:
+                gc.enable()
+        if best is None or elapsed < best:
+            best = elapsed
+    return best
+
+##
+# Times each stage of transliterating the corpus words on its own, feeding
+# every stage the output of the one before it.
+def StageTimes(words, dictionary, repeat):
+    cleanUpWord = syr2ipa.CleanUpWord
+    isBDOL = syr2ipa.IsBDOL
+    strToSyrChars = syr2ipa.StrToSyrChars
+    tokenize = syr2ipa.TokenizeLettersWithModifiers
+    render = syr2ipa.SyrCharTokensToOutput
+    findClusters = syr2ipa.DefaultScheme.clusterRuns.findall
+    renderClusters = syr2ipa.SyrClustersToOutput
+
+    cleaned = [cleanUpWord(word) for word in words]
+    syrChars = [strToSyrChars(word) for word in words]
+    tokens = [tokenize(chars) for chars in syrChars]
+
+    times = {}
+    times['clean'] = BestTime(lambda: [cleanUpWord(word) for word in words], repeat)
+    if dictionary:
+        times['bdol'] = BestTime(lambda: [isBDOL(word, dictionary) for word in cleaned], repeat)
+    else:
+        times['bdol'] = None
+    times['lookup'] = BestTime(lambda: [strToSyrChars(word) for word in words], repeat)
+    times['tokenize'] = BestTime(lambda: [tokenize(chars) for chars in syrChars], repeat)
+    times['render'] = BestTime(lambda: [render(wordTokens, 'ipa') for wordTokens in tokens], repeat)
+    # the fast path, splitting and rendering in place of lookup, tokenize and render
+    times['clusters'] = BestTime(lambda: [renderClusters(findClusters(word), 'ipa') for word in words], repeat)
+    return times
+
+##
+# Runs one scenario, returning its results as a JSON-serializable dict.
+def RunScenario(scenario, n_words, repeat, seed):
+    words, dictionary = GenerateCorpus(scenario, n_words, seed)
+    text = CorpusText(words, seed)
+
+    uncached = syr2ipa.Transliterator(dictionary=dictionary, cache_size=0)
+    uncachedTime = BestTime(lambda: uncached.transliterate(text), repeat)
+
+    cached = syr2ipa.Transliterator(dictionary=dictionary)
+    cached.transliterate(text)
+    cachedTime = BestTime(lambda: cached.transliterate(text), repeat)
+
+    tracemalloc.start()
+    syr2ipa.Transliterator(dictionary=dictionary, cache_size=0).transliterate(text)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return {
+        'chars': len(text),
+        'words': len(words),
+        'chars_per_sec': len(text) / uncachedTime,
+        'words_per_sec': len(words) / uncachedTime,
+        'cached_chars_per_sec': len(text) / cachedTime,
+        'stage_seconds': StageTimes(words, dictionary, repeat),
+        'peak_memory_bytes': peak,
+    }
+
+def GitCommit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        return None
+
+def PrintResults(results):
+    for scenario, result in results['scenarios'].items():
+        print(f'{scenario} ({result["words"]:,} words, {result["chars"]:,} chars)')
+        print(f'  uncached:    {result["chars_per_sec"]:>14,.0f} chars/sec {result["words_per_sec"]:>12,.0f} words/sec')
+        print(f'  cached:      {result["cached_chars_per_sec"]:>14,.0f} chars/sec')
+        print(f'  peak memory: {result["peak_memory_bytes"] / (1 << 20):>14.1f} MiB')
+        for stage in Stages:
+            seconds = result['stage_seconds'][stage]
+            if seconds is not None:
+                print(f'  {stage + ":":<12} {seconds * 1000:>14.2f} ms')
+
+##
+# Prints the change of every metric between a saved run and this one.
+# Rates and memory are compared as new / old, stage times as old / new, so
+# above 1.00x is always an improvement.
+def PrintComparison(old, new):
+    print(f'compared with {old.get("commit") or "saved run"}: above 1.00x is better')
+    if (old.get('words'), old.get('seed')) != (new['words'], new['seed']):
+        print('warning: the runs used different corpora (--words or --seed), stage times are not comparable')
+    for scenario, result in new['scenarios'].items():
+        oldResult = old['scenarios'].get(scenario)
+        if oldResult is None:
+            continue
+        print(scenario)
+        for metric in ('chars_per_sec', 'words_per_sec', 'cached_chars_per_sec'):
+            print(f'  {metric:<22} {result[metric] / oldResult[metric]:>6.2f}x')
+        print(f'  {"peak_memory_bytes":<22} {oldResult["peak_memory_bytes"] / result["peak_memory_bytes"]:>6.2f}x')
+        for stage in Stages:
+            seconds, oldSeconds = result['stage_seconds'].get(stage), oldResult['stage_seconds'].get(stage)
+            if seconds and oldSeconds:
+                print(f'  {stage:<22} {oldSeconds / seconds:>6.2f}x')
+
+def BuildArgumentParser():
+    parser = argparse.ArgumentParser(description='syr2ipa benchmarks')
+    parser.add_argument('-s', '--scenario', action='append', choices=Scenarios,
+                        help='Scenario to run, may be repeated. Default is all of them.')
+    parser.add_argument('-w', '--words', type=int, default=20000,
+                        help='Number of words in each generated corpus')
+    parser.add_argument('-r', '--repeat', type=int, default=5,
+                        help='Runs per measurement; the fastest is kept')
+    parser.add_argument('--seed', type=int, default=2021,
+                        help='Seed of the generated corpora')
+    parser.add_argument('--json', metavar='PATH',
+                        help='Save the results to a JSON file')
+    parser.add_argument('--compare', metavar='PATH',
+                        help='Compare the results with a JSON file saved by an earlier run')
+    parser.add_argument('--verify', action='store_true',
+                        help='Check that the cluster fast path renders every corpus word, and random noise in each scheme, like the token engine')
+    parser.add_argument('--linear-baseline', action='store_true',
+                        help='Also compare the compiled character table with the old linear scan')
+    return parser
+
+def main(argv=None):
+    args = BuildArgumentParser().parse_args(argv)
+
+    if args.verify:
+        failed = False
+        west = syr2ipa.GetScheme('west')
+        corpora = [(scenario, GenerateCorpus(scenario, args.words, args.seed)[0], None) for scenario in args.scenario or Scenarios]
+        corpora.append(('noise', GenerateNoise(args.words, args.seed), None))
+        corpora.append(('west noise', GenerateNoise(args.words, args.seed, west), west))
+        for name, words, scheme in corpora:
+            differences = VerifyFastPath(words, scheme)
+            print(f'verify {name}: {len(words):,} words, {len(differences):,} differences')
+            for word, mode, expected, output in differences[:10]:
+                print(f'  {word!r} {mode}: {expected!r} != {output!r}')
+            failed = failed or bool(differences)
+        if failed:
+            exit(1)
+
+    if args.linear_baseline:
+        text = SAMPLE * 10
+        before = CharsPerSecond(StrToSyrCharsLinear, text, 200)
+        after = CharsPerSecond(syr2ipa.StrToSyrChars, text, 2000)
+        print(f'linear scan:    {before:>14,.0f} chars/sec')
+        print(f'compiled table: {after:>14,.0f} chars/sec')
+        print(f'speedup:        {after / before:>14.1f}x')
+
+    results = {
+        'commit': GitCommit(),
+        'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': platform.python_version(),
+        'words': args.words,
+        'repeat': args.repeat,
+        'seed': args.seed,
+        'scenarios': {},
+    }
+    for scenario in args.scenario or Scenarios:
+        results['scenarios'][scenario] = RunScenario(scenario, args.words, args.repeat, args.seed)
+
+    PrintResults(results)
+
+    if args.json:
+        with open(args.json, 'w') as outputFile:
+            json.dump(results, outputFile, indent=2)
+
+    if args.compare:
+        try:
+            with open(args.compare, 'r') as inputFile:
+                old = json.load(inputFile)
+        except:
+            print(f'Error: could not open results file {args.compare}'.format())
+            exit(1)
+        PrintComparison(old, results)
+
+if __name__ == "__main__":
+    main()
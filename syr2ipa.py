@@ -8,74 +8,91 @@
 # date 1 March 2021
 ##
 
+import os
+import io
 import sys
+import time
+import atexit
+import threading
 import argparse
 import json
-
-parser = argparse.ArgumentParser(description='syr2ipa - Syriac to IPA transcriber')
-parser.add_argument('-t', '--text',
-                    help='Pass input text via this argument in stdin')
-parser.add_argument('-f', '--file',
-                    help='Read Syriac input from a text file')
-parser.add_argument('-o', '--output',
-                    help='Specify which file to write out the transcription to. Default is stdout.')
-parser.add_argument('-l', '--latin', action='store_true',
-                    help='Transcibe into latin phonetics in place of IPA')
-parser.add_argument('-d', '--dictionary',
-                    help='Load a JSON word dictionary to improve accuracy')
-parser.add_argument('-v', '--verbose', action='store_true',
-                    help='Enable verbose logging output')
-args = parser.parse_args()
+import re
+import hashlib
+import marshal
+import mmap
+import struct
+import zlib
+import unicodedata
+import multiprocessing
+from collections import OrderedDict, deque
+from itertools import accumulate, chain, islice
+from bisect import bisect_right
+from array import array
+from sys import intern
 
 def IsBDOL(word, dictionary):
     bdol_list = ['ܒ', 'ܕ', 'ܘ', 'ܠ']
-    vowels = ['ܲ', 'ܵ', 'ܸ', 'ܼ', 'ܿ', 'ܹ']
-    diacritics = ['݂', '݁', '̇', '̣', '̈', '݇', '̰', '̃', '̮']
 
     if len(word) > 1:
         if word[0] in bdol_list:
-            if word[1] not in vowels and word[1] not in diacritics:
-                if word[1:] in dictionary.keys():
+            if word[1] not in WordKeyMarks:
+                if word[1:] in dictionary:
                     return True, word[1:]
     return False, word
 
+# the characters a dictionary key is made of
+WordKeyLetters = ['ܐ', 'ܑ', 'ܒ', 'ܓ', 'ܕ', 'ܖ', 'ܗ', 'ܘ', 'ܙ', 'ܚ', 'ܛ', 'ܝ', 'ܟ', 'ܠ', 'ܡ', 'ܢ', 'ܣ', 'ܤ', 'ܥ', 'ܦ', 'ܨ', 'ܩ', 'ܪ', 'ܫ', 'ܬ']
+# the East vowels, then the rest of the Syriac vowel points (U+0730-U+073F), so
+# that West Syriac words keep their vowels too
+WordKeyVowels = ['ܲ', 'ܵ', 'ܸ', 'ܼ', 'ܿ', 'ܹ'] + [chr(c) for c in range(0x730, 0x740) if chr(c) not in 'ܸܼܹܲܵܿ']
+# the East diacritics, then the rest of the Syriac marks (U+0740-U+074A)
+WordKeyDiacritics = ['݂', '݁', '̇', '̣', '̈', '݇', '̰', '̃', '̮'] + [chr(c) for c in range(0x740, 0x74b) if chr(c) not in '݂݁݇']
+NonWordKeyChars = re.compile('[^' + ''.join(WordKeyLetters + WordKeyVowels + WordKeyDiacritics) + ']')
+# the marks that keep the letter they follow from being a BDOL prefix
+WordKeyMarks = frozenset(WordKeyVowels + WordKeyDiacritics)
+
+##
+# Reduces a word to its dictionary key, dropping whitespace, punctuation and
+# anything else that is not a letter, vowel or diacritic.
 def CleanUpWord(word):
-    letters = ['ܐ', 'ܑ', 'ܒ', 'ܓ', 'ܕ', 'ܖ', 'ܗ', 'ܘ', 'ܙ', 'ܚ', 'ܛ', 'ܝ', 'ܟ', 'ܠ', 'ܡ', 'ܢ', 'ܣ', 'ܤ', 'ܥ', 'ܦ', 'ܨ', 'ܩ', 'ܪ', 'ܫ', 'ܬ']
-    vowels = ['ܲ', 'ܵ', 'ܸ', 'ܼ', 'ܿ', 'ܹ']
-    diacritics = ['݂', '݁', '̇', '̣', '̈', '݇', '̰', '̃', '̮']
-    word = word.rstrip().lstrip()
-    newWord = ''
-    for char in word:
-        if char in letters or char in vowels or char in diacritics:
-            newWord += char
-    return newWord
+    return NonWordKeyChars.sub('', word)
+
+# the kinds of SyrChar, in the order TokenizeLettersWithModifiers tells them apart
+LetterKind, NonSyrKind, PunctuationKind, ModifierKind, TalqanaKind, QanunaKind, SiyamehKind, VowelKind, OtherKind = range(9)
 
 class SyrChar:
+    __slots__ = ('name', 'character', 'kind', 'is_letter', 'is_modifer', 'is_punctuation', 'punctuation_override',
+                 'is_vowel', 'is_talqana', 'is_qanuna', 'is_siyameh', 'latin', 'ipa', 'letter_outputs',
+                 'keeps_letter', 'is_western', 'outputs')
+
     ##
     # name:       str - the name of the of character
     # character:  str - a unicode string represnting the character
     # is_letter:  bool - a flag denoting if this is a base letter
-    # is_modifer: bool - a flag denoting if this is a modifier (majleana, rukakha, qushaya, khwasa, rwakha, qanuna)
-    # modifier_function: func - a function with a str parameter that each modifier should have
+    # is_modifer: bool - a flag denoting if this is a modifier (majleana, rukakha, qushaya, khwasa, rwakha)
     # is_vowel:   bool - a flag denoting if this is a vowel
+    # outputs:    dict - extra output modes beyond ipa and latin, mode name -> str
+    # letter_outputs: dict - for marks, how the mark renders the letters it changes, letter -> outputs
+    # keeps_letter: bool - for marks, whether letters missing from letter_outputs keep their own sound
+    # is_western: bool - a flag denoting a character only written in West Syriac (see AutoScheme)
     def __init__(self, name, character, 
                 is_letter = False, 
-                is_matres = False, 
                 is_modifer = False,
                 is_qanuna = False,
-                modifier_function = None, 
                 is_vowel = False, 
                 is_punctuation = False,
                 is_talqana = False,
                 is_siyameh = False,
                 punctuation_override = '',
-                latin = '', ipa = ''):
+                latin = '', ipa = '',
+                outputs = None,
+                letter_outputs = None,
+                keeps_letter = False,
+                is_western = False):
         self.name = name
         self.character = character
         self.is_letter = is_letter
-        self.is_matres = is_matres
         self.is_modifer = is_modifer
-        self.modifier_function = modifier_function
         self.is_punctuation = is_punctuation
         self.punctuation_override = punctuation_override
         self.is_vowel = is_vowel
@@ -84,470 +101,2491 @@ class SyrChar:
         self.is_siyameh = is_siyameh
         self.latin = latin
         self.ipa = ipa
-
-        if (self.is_modifer or self.is_matres or self.is_talqana or self.is_qanuna or self.is_siyameh) and self.modifier_function is None:
-            print(f'Error: defining a modifier: {n}, but not modifier function was definined - exiting'.format(n=self.name))
-            exit(1)
-
-    def Modify(self, letter, previous_token, this_token, next_token):
-        ipa   = ''
-        latin = ''
-
-        if self.modifier_function is None:
-            return '',''
-        return self.modifier_function(letter, previous_token, this_token, next_token)
+        self.letter_outputs = letter_outputs or {}
+        self.keeps_letter = keeps_letter
+        self.is_western = is_western
+
+        # the rendering of this character in each output mode
+        self.outputs = {'ipa': ipa, 'latin': latin}
+        if outputs:
+            self.outputs.update(outputs)
+        if self.is_punctuation:
+            punctuation = self.punctuation_override if self.punctuation_override != '' else self.character
+            self.outputs = dict.fromkeys(self.outputs, punctuation)
+
+        if is_letter:
+            self.kind = LetterKind
+        elif name == 'NON-SYR-CHAR':
+            self.kind = NonSyrKind
+        elif is_punctuation:
+            self.kind = PunctuationKind
+        elif is_modifer:
+            self.kind = ModifierKind
+        elif is_talqana:
+            self.kind = TalqanaKind
+        elif is_qanuna:
+            self.kind = QanunaKind
+        elif is_siyameh:
+            self.kind = SiyamehKind
+        elif is_vowel:
+            self.kind = VowelKind
+        else:
+            self.kind = OtherKind
 
     def GetPunctuation(self):
-        ipa = ''
-        latin = ''
         if self.is_punctuation:
-            if self.punctuation_override != '':
-                ipa = self.punctuation_override
-                latin = self.punctuation_override
-            else:
-                ipa = self.character
-                latin = self.character
-        return ipa, latin
+            return self.outputs['ipa'], self.outputs['latin']
+        return '', ''
+
+##
+# The render table key of a letter, mark and vowel, any of which may be None.
+# Letters, marks and vowels are disjoint sets of characters, so their
+# concatenation is unambiguous, and a string hashes once where a tuple would
+# hash on every lookup. SyrToken builds the same key inline.
+def RenderKey(base, mark, vowel):
+    return intern((base.character if base else '') +
+                  (mark.character if mark else '') +
+                  (vowel.character if vowel else ''))
 
 class SyrToken:
-    def __init__(self, token):
-        self.nonsyr = None
-        self.base = None
-        self.modifier = None
-        self.punctuation = None
-        self.talqana = None
-        self.vowel = None
-        self.qanuna = None
-        self.siyameh = None
-
-        n_letter  = 0
-        n_modifer = 0
-        n_vowel   = 0
-
-        for t in token:
-            if t.is_letter:
-                if n_letter == 0:
-                    self.base = t
-                n_letter += 1
-            elif t.name == 'NON-SYR-CHAR':
-                self.nonsyr = t
-            elif t.is_punctuation:
-                self.punctuation = t
-            elif t.is_modifer:
-                if n_modifer == 0:
-                    self.modifier = t
-                n_modifer += 1
-            elif t.is_talqana:
-                self.talqana = t
-            elif t.is_qanuna:
-                self.qanuna = t
-            elif t.is_siyameh:
-                self.siyameh = t
-            elif t.is_vowel:
-                if n_vowel == 0:
-                    self.vowel = t
-                n_vowel += 1
+    __slots__ = ('base', 'modifier', 'vowel', 'punctuation', 'talqana', 'qanuna', 'siyameh', 'nonsyr', 'key')
 
-def SyrCharTokensToIPA(tokens):
+    ##
+    # A letter with the marks that follow it, or a single non-Syriac character.
+    # Each field is a SyrChar or None.
+    def __init__(self, base, modifier, vowel, punctuation, talqana, qanuna, siyameh, nonsyr = None):
+        self.base = base
+        self.modifier = modifier
+        self.vowel = vowel
+        self.punctuation = punctuation
+        self.talqana = talqana
+        self.qanuna = qanuna
+        self.siyameh = siyameh
+        self.nonsyr = nonsyr
+
+        # the key of this token in the render tables: its letter, the mark that
+        # decides the letter's sound and its vowel, as one string. A siyameh
+        # takes precedence over a modifier, and a modifier over a qanuna.
+        mark = siyameh or modifier or qanuna
+        key = base.character if base else ''
+        if mark:
+            key += mark.character
+        if vowel:
+            key += vowel.character
+        self.key = intern(key)
+
+##
+# Renders a tokenized word in a single output mode ('ipa', 'latin', ...).
+# Each letter is a lookup of its (letter, mark, vowel) key in the compiled
+# render table for its position; only the few keys with context rules left
+# look at the neighbouring tokens.
+def SyrCharTokensToOutput(tokens, mode, scheme=None):
     n_tokens = len(tokens)
     if n_tokens == 0:
-        return '',''
+        return ''
 
-    ipa = ''
-    latin = ''
+    medial, initial, final, only = (scheme or DefaultScheme).renderTables[mode]
+    output = []
+    append = output.append
 
+    last = n_tokens - 1
+    table = initial if last else only
     previous_token = None
-    next_token = None
     for t_itor in range(0, n_tokens):
         t = tokens[t_itor]
-        
+
         if t.base is None:
             if t.punctuation:
-                return t.punctuation.GetPunctuation()
+                return t.punctuation.outputs[mode]
 
-        next_token = None
-        if t_itor + 1 <= n_tokens - 1:
-            next_token = tokens[t_itor + 1]
-
-        i = ''
-        l = ''
-        
         if t.nonsyr:
-            ipa += t.nonsyr.character
-            latin += t.nonsyr.character
+            append(t.nonsyr.character)
         elif t.talqana:
-            i, l = t.talqana.Modify(t.base, previous_token, t, next_token)
+            pass
         else:
-            if t.siyameh:
-                i, l = t.siyameh.Modify(t.base, previous_token, t, next_token)
-            elif t.modifier:
-                i, l = t.modifier.Modify(t.base, previous_token, t, next_token)
-            elif t.qanuna:
-                i, l = t.qanuna.Modify(t.base, previous_token, t, next_token)
-            elif t.base.is_matres:
-                i, l = t.base.Modify(t.base, previous_token, t, next_token)
-            else:
-                i += t.base.ipa
-                l += t.base.latin
-            ipa += i
-            latin += l
-
-            if t.vowel:
-                ipa   += t.vowel.ipa
-                latin += t.vowel.latin
+            entry = table[t.key]
+            if entry.__class__ is tuple:
+                contextRules, entry = entry
+                next_token = tokens[t_itor + 1] if t_itor < last else None
+                context = (previous_token, t, next_token)
+                for condition, ruleOutput in contextRules:
+                    if ConditionHolds(condition, context):
+                        entry = ruleOutput
+                        break
+            append(entry)
 
         if t.punctuation:
-            i, l = t.punctuation.GetPunctuation()
-            ipa += i
-            latin += l
+            append(t.punctuation.outputs[mode])
 
         previous_token = t
+        table = medial if t_itor + 1 < last else final
+
+    return ''.join(output)
+
+##
+# Renders a word split into clusters (see CompileClusterRuns) in a single
+# output mode, with the same output as SyrCharTokensToOutput. Most clusters
+# render to a fixed string whatever their neighbours, and these are looked up
+# and joined in bulk; join fails on any other entry, and only then are the
+# clusters whose rules need their neighbours resolved one by one.
+def SyrClustersToOutput(clusters, mode, scheme=None):
+    n_clusters = len(clusters)
+    if n_clusters == 0:
+        return ''
+
+    scheme = scheme or DefaultScheme
+    medial, initial, final, only = scheme.clusterTables[mode]
+    if n_clusters == 1:
+        outputs = [only[clusters[0]]]
+    else:
+        outputs = list(map(medial.__getitem__, clusters))
+        outputs[0] = initial[clusters[0]]
+        outputs[-1] = final[clusters[-1]]
+    try:
+        return ''.join(outputs)
+    except TypeError:
+        pass
+
+    tokens = scheme.clusterTokens
+    last = n_clusters - 1
+    for c_itor, entry in enumerate(outputs):
+        if entry is None:
+            return SyrCharTokensToOutput([tokens[cluster] for cluster in clusters], mode, scheme)
+        if entry.__class__ is tuple:
+            contextRules, entry, punctuation = entry
+            context = (tokens[clusters[c_itor - 1]] if c_itor else None, tokens[clusters[c_itor]],
+                       tokens[clusters[c_itor + 1]] if c_itor < last else None)
+            for condition, ruleOutput in contextRules:
+                if ConditionHolds(condition, context):
+                    entry = ruleOutput
+                    break
+            outputs[c_itor] = entry + punctuation
+    return ''.join(outputs)
+
+def SyrCharTokensToIPA(tokens):
+    return SyrCharTokensToOutput(tokens, 'ipa'), SyrCharTokensToOutput(tokens, 'latin')
 
-    return ipa, latin
+##
+# Tests used by the context rules below. Each looks at one token of the
+# (previous_token, this_token, next_token) context, or None past either end
+# of the word, and the value a rule expects there: True or False for the
+# presence of a vowel, letter or modifier on that token, or a list of the
+# vowel names, letters or modifier names allowed.
+def VowelTest(token, expected):
+    if token is None:
+        return False
+    if expected is True or expected is False:
+        return (token.vowel is not None) is expected
+    return token.vowel is not None and token.vowel.name in expected
+
+def LetterTest(token, expected):
+    if expected is False:
+        return token is None or token.base is None
+    if token is None or token.base is None:
+        return False
+    return expected is True or token.base.character in expected
+
+def ModifierTest(token, expected):
+    return token is not None and token.modifier is not None and token.modifier.name in expected
+
+# condition name -> (token it looks at: 0 previous, 1 this, 2 next, test)
+ContextConditions = {
+    'previous_vowel':  (0, VowelTest),
+    'next_vowel':      (2, VowelTest),
+    'previous_letter': (0, LetterTest),
+    'next_letter':     (2, LetterTest),
+    'next_modifier':   (2, ModifierTest),
+}
 
-def ModifierKhwasa(letter, previous_token, t, next_token):
-    ipa   = ''
-    latin = ''
+##
+# Compiles the 'when' conditions of a rule into a tuple of (test, position,
+# expected), checked in the order given by ConditionHolds. Compiled
+# conditions are plain data rather than closures, so schemes and the
+# transliterators holding them can be pickled, as worker processes started
+# by spawn need.
+def CompileCondition(when):
+    return tuple([(ContextConditions[name][1], ContextConditions[name][0], expected)
+                  for name, expected in when.items()])
+
+# whether every test of a compiled condition holds in the context
+def ConditionHolds(condition, context):
+    for test, position, expected in condition:
+        if not test(context[position], expected):
+            return False
+    return True
 
-    # shorten the khwasa if constrained by two shleekheh atwateh
-    shorten = False
-    if not previous_token is None and not next_token is None:
-        if not previous_token.vowel and not next_token.vowel:
-            shorten = True
+def PrintSyrCharArray(syrChars):
+    for char in syrChars:
+        print(f'{char.name}: {char.character}'.format())
+
+##
+# Groups SyrChars, from any iterable, into tokens: a letter with the marks that
+# follow it, or a non-Syriac character on its own. The marks of the token being
+# built are kept in locals, so no list is made per token. Within a token the
+# first modifier and vowel count, and the last of any other mark.
+def TokenizeLettersWithModifiers(SyrChars):
+    tokens = []
+    append = tokens.append
 
-    if letter.character == 'ܝ':
-        if shorten:
-            ipa = 'ɪ'
-            latin = 'i'
+    pending = False
+    base = modifier = vowel = punctuation = talqana = qanuna = siyameh = None
+    for char in SyrChars:
+        kind = char.kind
+        if kind <= NonSyrKind:
+            if pending:
+                append(SyrToken(base, modifier, vowel, punctuation, talqana, qanuna, siyameh))
+                base = modifier = vowel = punctuation = talqana = qanuna = siyameh = None
+            if kind == NonSyrKind:
+                append(SyrToken(None, None, None, None, None, None, None, char))
+                pending = False
+                continue
+            base = char
+        elif kind == VowelKind:
+            if vowel is None:
+                vowel = char
+        elif kind == ModifierKind:
+            if modifier is None:
+                modifier = char
+        elif kind == PunctuationKind:
+            punctuation = char
+        elif kind == TalqanaKind:
+            talqana = char
+        elif kind == QanunaKind:
+            qanuna = char
+        elif kind == SiyamehKind:
+            siyameh = char
+        pending = True
+
+    if pending:
+        append(SyrToken(base, modifier, vowel, punctuation, talqana, qanuna, siyameh))
+
+    return tokens
+
+##
+# A codepoint -> SyrChar table that maps any other character to its shared
+# NON-SYR-CHAR, so a word can be looked up with map() and no per-char branch.
+class SyrCharLookup(dict):
+    __slots__ = ()
+
+    def __missing__(self, char):
+        return GetNonSyrChar(char)
+
+##
+# Compiles a list of SyrChars into a codepoint lookup table.
+# Later definitions of the same codepoint replace earlier ones, matching the
+# order in which the character lists are declared.
+def CompileSyrCharTable(syrChars):
+    table = SyrCharLookup()
+    for syrChar in syrChars:
+        table[syrChar.character] = syrChar
+    return table
+
+##
+# Compiles the regex splitting a word into clusters, the characters that
+# TokenizeLettersWithModifiers makes one token of: a letter with the marks
+# after it, marks with no letter before them, or any other single character.
+def CompileClusterRuns(charTable):
+    letters = ''.join([re.escape(char) for char, syrChar in charTable.items() if syrChar.kind == LetterKind])
+    marks = ''.join([re.escape(char) for char, syrChar in charTable.items() if syrChar.kind > NonSyrKind])
+    return re.compile(f'[{letters}][{marks}]*|[{marks}]+|.', re.DOTALL)
+
+##
+# Compiles the search for the characters of a word that are not in a
+# character table, and so render as themselves.
+def CompileUnknownChars(charTable):
+    known = ''.join([re.escape(char) for char, syrChar in charTable.items() if syrChar.kind != NonSyrKind])
+    return re.compile(f'[^{known}]').findall
+
+# clusters longer than this, or met once the tables hold this many, are
+# worked out again each time rather than kept
+ClusterCacheLength = 8
+ClusterCacheSize = 1 << 16
+
+##
+# The token of each cluster, tokenized on first use.
+class ClusterTokens(dict):
+    __slots__ = ('charTable',)
+
+    def __init__(self, charTable):
+        self.charTable = charTable
+
+    def __missing__(self, cluster):
+        token, = TokenizeLettersWithModifiers(map(self.charTable.__getitem__, cluster))
+        if len(cluster) <= ClusterCacheLength and len(self) < ClusterCacheSize:
+            self[cluster] = token
+        return token
+
+##
+# The output of each cluster in one mode and position, worked out on first
+# use from the token's render table entry. An entry is the output string, or
+# for a token whose rules need its neighbours, (conditions, default,
+# punctuation output). A token of marks with punctuation and no letter cuts
+# its word short, so it maps to None and the word is rendered token by token.
+class ClusterTable(dict):
+    __slots__ = ('tokens', 'table', 'mode')
+
+    def __init__(self, tokens, table, mode):
+        self.tokens = tokens
+        self.table = table
+        self.mode = mode
+
+    def __missing__(self, cluster):
+        t = self.tokens[cluster]
+        punctuation = t.punctuation.outputs[self.mode] if t.punctuation else ''
+        if t.base is None and t.punctuation:
+            entry = None
+        elif t.nonsyr:
+            entry = t.nonsyr.character
+        elif t.talqana:
+            entry = punctuation
         else:
-            ipa = 'i'
-            latin = 'ee'
+            entry = self.table[t.key]
+            if entry.__class__ is tuple:
+                entry = entry + (punctuation,)
+            else:
+                entry = entry + punctuation
+        if len(cluster) <= ClusterCacheLength and len(self) < ClusterCacheSize:
+            self[cluster] = entry
+        return entry
 
-    elif letter.character == 'ܘ':
-        ipa = 'u'
-        latin = 'u'
-    
-    return ipa, latin
+# the positions of a token in its word, indexing the render tables of each mode
+MedialPosition, InitialPosition, FinalPosition, OnlyPosition = range(4)
 
-def ModifierRwakha(letter, previous_token, t, next_token):
-    ipa   = ''
-    latin = ''
+##
+# The rule conditions that only depend on a token's position in its word and
+# its own vowel. These are resolved when the render tables are compiled.
+def StaticConditionHolds(name, expected, position, vowel):
+    if name == 'initial':
+        return (position in (InitialPosition, OnlyPosition)) == expected
+    if name == 'final':
+        return (position in (FinalPosition, OnlyPosition)) == expected
+    if expected is True:
+        return vowel is not None
+    if expected is False:
+        return vowel is None
+    return vowel is not None and vowel.name in expected
+
+StaticConditions = ('initial', 'final', 'vowel')
 
-    if letter.character == 'ܘ':
-        ipa = 'o'
-        latin = 'o'
-    
-    return ipa, latin
-
-def ModifierMajliana(letter, previous_token, t, next_token):
-    ipa   = ''
-    latin = ''
-
-    if letter.character == 'ܓ':
-        ipa = 'dʒ'
-        latin = 'j'
-    elif letter.character == 'ܙ':
-        ipa = 'ʒ'
-        latin = 'zh'
-    elif letter.character == 'ܟ':
-        ipa = 'tʃ'
-        latin = 'ch'
-    elif letter.character == 'ܫ':
-        ipa = 'ʒ'
-        latin = 'zh'
-    
-    return ipa, latin
-
-def ModifierSiyameh(letter, previous_token, t, next_token):
-    ipa   = ''
-    latin = ''
-    if letter.character == 'ܖ':
-        ipa = 'r'
-        latin = 'r'
+##
+# Compiles a list of SyrChars and its context rules into render tables.
+# Each output mode gets four tables, one per position of a token in its word
+# (medial, initial, final, only), mapping the (letter, mark, vowel) key of a
+# token (see RenderKey) to its output. Keys whose rules still depend on the
+# neighbouring tokens map to (((rule index, output), ...), default) instead.
+# The tables hold only strings and tuples, so they can be cached with marshal;
+# Scheme packs and links them (see PackRenderTables and LinkRenderTables).
+#
+# Rules for a (letter, mark) pair are tried in order. A rule whose static
+# conditions fail for a key is dropped from it; one with no other conditions
+# left becomes the key's default, and later rules for the key are dropped.
+def CompileRenderTables(syrChars, contextRules):
+    syrCharTable = CompileSyrCharTable(syrChars)
+    letters = [None] + [c for c in syrCharTable.values() if c.is_letter]
+    marks = [None] + [c for c in syrCharTable.values() if c.is_modifer or c.is_siyameh or c.is_qanuna]
+    vowels = [None] + [c for c in syrCharTable.values() if c.is_vowel]
+    modes = []
+    for syrChar in syrCharTable.values():
+        modes += [mode for mode in syrChar.outputs if mode not in modes]
+
+    pairRules = {}
+    for index, rule in enumerate(contextRules):
+        when = rule.get('when', {})
+        static = [(name, expected) for name, expected in when.items() if name in StaticConditions]
+        dynamic = len(static) < len(when)
+        outputs = rule['outputs']
+        if not isinstance(outputs, dict):
+            outputs = dict.fromkeys(modes, outputs)
+        compiled = (index, static, dynamic, outputs)
+
+        if 'mark' in rule:
+            markChars = [m.character for m in marks[1:] if m.name == rule['mark']]
+        else:
+            markChars = [None]
+        for markChar in markChars:
+            pairRules.setdefault((rule['letter'], markChar), []).append(compiled)
+
+    # outputs are shared between keys, so the tables hold one copy of each
+    outputPool = {}
+    tables = {mode: tuple({} for position in range(4)) for mode in modes}
+    for letter in letters:
+        for mark in marks:
+            if letter is None:
+                outputs = {}
+            elif mark is None:
+                outputs = letter.outputs
+            elif letter.character in mark.letter_outputs:
+                # modes the mark does not name for the letter keep the letter's own
+                outputs = {**letter.outputs, **mark.letter_outputs[letter.character]}
+            elif mark.keeps_letter:
+                outputs = letter.outputs
+            else:
+                outputs = {}
+            rules = pairRules.get((letter.character if letter else None, mark.character if mark else None), [])
+
+            for vowel in vowels:
+                key = RenderKey(letter, mark, vowel)
+                for mode in modes:
+                    vowelOutput = vowel.outputs.get(mode, '') if vowel else ''
+                    for position in range(4):
+                        entry = outputs.get(mode, '') + vowelOutput
+                        keyRules = []
+                        for index, static, dynamic, ruleOutputs in rules:
+                            # a rule naming only some modes leaves the others to the default
+                            if mode not in ruleOutputs:
+                                continue
+                            if not all(StaticConditionHolds(name, expected, position, vowel) for name, expected in static):
+                                continue
+                            ruleOutput = ruleOutputs.get(mode, '') + vowelOutput
+                            if not dynamic:
+                                entry = ruleOutput
+                                break
+                            keyRules.append((index, ruleOutput))
+                        entry = outputPool.setdefault(entry, entry)
+                        tables[mode][position][key] = (tuple(keyRules), entry) if keyRules else entry
+
+    return tables
+
+##
+# Packs compiled render tables for the scheme cache as mode -> (medial table,
+# (the initial, final and only entries that differ from it)), since only a
+# few keys render differently by position. UnpackRenderTables reverses it.
+def PackRenderTables(tables):
+    packed = {}
+    for mode, (medial, *positionTables) in tables.items():
+        packed[mode] = (medial, tuple({key: entry for key, entry in table.items() if medial[key] != entry}
+                                      for table in positionTables))
+    return packed
+
+def UnpackRenderTables(packed):
+    return {mode: (medial,) + tuple({**medial, **changes} for changes in positionChanges)
+            for mode, (medial, positionChanges) in packed.items()}
+
+##
+# Replaces the rule indexes left in packed render tables with the rules'
+# conditions on the neighbouring tokens, ready for SyrCharTokensToOutput.
+def LinkRenderTables(packed, contextRules):
+    conditions = []
+    for rule in contextRules:
+        dynamic = {name: expected for name, expected in rule.get('when', {}).items() if name not in StaticConditions}
+        conditions.append(CompileCondition(dynamic) if dynamic else None)
+
+    for medial, positionChanges in packed.values():
+        for table in (medial,) + positionChanges:
+            for key, entry in table.items():
+                if entry.__class__ is tuple:
+                    keyRules, default = entry
+                    table[key] = ([(conditions[index], output) for index, output in keyRules], default)
+    return packed
+
+##
+# Character schemes
+#
+# A scheme is a JSON file holding the characters of a script and the context
+# rules that render them (see schemes/east.json):
+#   name:       str - the name of the scheme
+#   characters: list - SyrChar keyword arguments; a later definition of a
+#               codepoint replaces an earlier one
+#   rules:      list - context rules, the cases where a (letter, mark) pair does
+#               not map to a fixed output. Each names a 'letter', optionally a
+#               'mark', the 'when' conditions that must all hold (see
+#               StaticConditions and ContextConditions) and the 'outputs', a
+#               string for every mode or a dict of mode -> str. Rules for the
+#               same pair are tried in order; one without 'when' always applies.
+#
+# Compiled schemes are cached with marshal under SchemeCacheDir, keyed on the
+# hash of the JSON, so only the first load of a scheme pays for compiling it.
+
+SchemesDir = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'schemes')
+SchemeCacheDir = os.path.join(os.environ.get('XDG_CACHE_HOME') or os.path.expanduser('~/.cache'), 'syr2ipa')
+# bump whenever the layout or the compiling of the tables changes
+SchemeCacheVersion = 2
+
+class Scheme:
+    ##
+    # name:       str - the name of the scheme
+    # key:        str - the hash of the scheme's JSON, identifying it in caches
+    # characters: list - the SyrChar keyword arguments of its characters
+    # rules:      list - its context rules
+    # tables:     dict - its render tables, as returned by PackRenderTables
+    def __init__(self, name, key, characters, rules, tables):
+        self.name = name
+        self.key = key
+        self.rules = rules
+        self.syrChars = [SyrChar(**definition) for definition in characters]
+        self.charTable = CompileSyrCharTable(self.syrChars)
+        self.renderTables = UnpackRenderTables(LinkRenderTables(tables, rules))
+        self.modes = tuple(self.renderTables)
+        # punctuation is copied in every mode, also in modes only other characters name
+        for syrChar in self.syrChars:
+            if syrChar.is_punctuation:
+                punctuation = syrChar.punctuation_override if syrChar.punctuation_override != '' else syrChar.character
+                for mode in self.modes:
+                    syrChar.outputs.setdefault(mode, punctuation)
+        self.clusterRuns = CompileClusterRuns(self.charTable)
+        self.findUnknown = CompileUnknownChars(self.charTable)
+        self.clusterTokens = ClusterTokens(self.charTable)
+        self.clusterTables = {mode: tuple([ClusterTable(self.clusterTokens, table, mode) for table in positionTables])
+                              for mode, positionTables in self.renderTables.items()}
+
+    # the scheme rendering word, for callers that may hold an AutoScheme
+    def Select(self, word):
+        return self
+
+##
+# Loads a scheme JSON file, from the compiled cache when it has one.
+# Failing to read or write the cache only costs a compile.
+def LoadScheme(path):
+    with open(path, 'rb') as schemeFile:
+        source = schemeFile.read()
+    key = hashlib.sha256(source).hexdigest()
+    cacheTag = f'{key}-{SchemeCacheVersion}-py{sys.version_info[0]}{sys.version_info[1]}'
+    cachePath = os.path.join(SchemeCacheDir, cacheTag + '.marshal')
+
+    try:
+        with open(cachePath, 'rb') as cacheFile:
+            name, characters, rules, tables = marshal.loads(cacheFile.read())
+    except (OSError, EOFError, ValueError, TypeError):
+        definition = json.loads(source)
+        name, characters, rules = definition['name'], definition['characters'], definition['rules']
+        tables = PackRenderTables(CompileRenderTables([SyrChar(**c) for c in characters], rules))
+        try:
+            os.makedirs(SchemeCacheDir, exist_ok=True)
+            partialPath = f'{cachePath}.{os.getpid()}'
+            with open(partialPath, 'wb') as cacheFile:
+                marshal.dump((name, characters, rules, tables), cacheFile)
+            os.replace(partialPath, cachePath)
+        except OSError:
+            pass
+
+    return Scheme(name, key, characters, rules, tables)
+
+# loaded schemes by path, so transliterators using the same scheme share it
+Schemes = {}
+
+##
+# Returns the scheme of a name in SchemesDir ('east', ...) or of a JSON path,
+# or the AutoScheme of East and West Syriac for 'auto'.
+def GetScheme(scheme):
+    if scheme.lower() == 'auto':
+        if 'auto' not in Schemes:
+            Schemes['auto'] = AutoScheme(GetScheme('east'), GetScheme('west'))
+        return Schemes['auto']
+    path = scheme
+    if not os.path.isfile(path):
+        path = os.path.join(SchemesDir, scheme.lower() + '.json')
+    path = os.path.abspath(path)
+    if path not in Schemes:
+        Schemes[path] = LoadScheme(path)
+    return Schemes[path]
+
+##
+# Renders texts mixing East and West Syriac, picking the scheme of each word:
+# words holding any character the West scheme marks is_western render with
+# it, the rest with the East one. The marker characters are compiled into one
+# regex character class, a codepoint bitmap that re scans in C, so telling
+# the dialect of a word costs a single pass over it.
+class AutoScheme:
+    ##
+    # east: Scheme - the scheme of words with no West Syriac characters
+    # west: Scheme - the scheme of words with any
+    def __init__(self, east, west):
+        self.name = 'AUTO'
+        self.key = hashlib.sha256(f'{east.key}:{west.key}'.encode()).hexdigest()
+        self.east = east
+        self.west = west
+        # a word may render with either, so only the modes both have
+        self.modes = tuple([mode for mode in east.modes if mode in west.modes])
+        markers = ''.join([re.escape(syrChar.character) for syrChar in west.syrChars if syrChar.is_western])
+        self._findWestern = re.compile(f'[{markers}]').search
+
+    def Select(self, word):
+        return self.west if self._findWestern(word) else self.east
+
+DefaultScheme = GetScheme('east')
+SyrChars = DefaultScheme.syrChars
+
+# shared NON-SYR-CHAR sentinels, one per distinct non-Syriac character
+NonSyrChars = {}
+
+def GetNonSyrChar(char):
+    nonSyrChar = NonSyrChars.get(char)
+    if nonSyrChar is None:
+        nonSyrChar = NonSyrChars.setdefault(char, SyrChar('NON-SYR-CHAR', char))
+    return nonSyrChar
+
+def StrToSyrChars(word, scheme=None):
+    return list(map((scheme or DefaultScheme).charTable.__getitem__, word))
+
+OutputModes = ('ipa', 'latin')
+
+##
+# The pass every word render goes through: reads the word as a BDOL if the
+# dictionary has it as one, writing an apostrophe after its first letter, and
+# renders it into each of modes. The word is split into clusters once (see
+# SyrClustersToOutput); modes that are not requested are never rendered.
+# Verbose runs print the parsed characters and render token by token.
+#
+# Returns the outputs, the word's dictionary key (see CleanUpWord), made only
+# with a dictionary or when keyed, and whether it was read as a BDOL. Given a
+# stats record, its tokens, unknown characters and BDOL hits are counted.
+def RenderWord(word, modes, dictionary, verbose, scheme, keyed = False, record = None):
+    key = CleanUpWord(word) if dictionary or keyed else None
+    is_bdol = False
+    if dictionary:
+        is_bdol, _ = IsBDOL(key, dictionary)
+        if is_bdol:
+            word = word[0] + "'" + word[1:]
+
+    scheme = (scheme or DefaultScheme).Select(word)
+    if verbose:
+        syrCharArray = StrToSyrChars(word, scheme)
+        PrintSyrCharArray(syrCharArray)
+        tokens = TokenizeLettersWithModifiers(syrCharArray)
+        outputs = tuple([SyrCharTokensToOutput(tokens, mode, scheme) for mode in modes])
     else:
-        ipa = letter.ipa
-        latin = letter.latin
-
-    return ipa, latin
-
-def ModifierMatres(letter, previous_token, t, next_token):
-    ipa   = ''
-    latin = ''
-    if letter.character == 'ܐ':
-        if t.vowel:
-            ipa = ''
-            latin = ''
-        elif previous_token is None:
-            if next_token and next_token.modifier and (next_token.modifier.name == 'KHWASA' or next_token.modifier.name == 'RWAKHA'):
-                    ipa = ''
-                    latin = ''
+        # each cluster is one token
+        tokens = scheme.clusterRuns.findall(word)
+        outputs = tuple([SyrClustersToOutput(tokens, mode, scheme) for mode in modes])
+
+    if record is not None:
+        record['tokens'] += len(tokens)
+        # not counting the apostrophe marking a BDOL
+        record['unknown_chars'] += len(scheme.findUnknown(word)) - is_bdol
+        record['bdol_hits'] += is_bdol
+    return outputs, key, is_bdol
+
+##
+# Transliterates a single word into each of the requested output modes,
+# returning one string per mode (see RenderWord).
+def SyrWordToOutputs(word, modes=OutputModes, dictionary=None, verbose=False, scheme=None):
+    return RenderWord(word, modes, dictionary, verbose, scheme)[0]
+
+# what a word record render returns: the word's outputs in every mode, then
+# its dictionary key (see CleanUpWord) and whether it was read as a BDOL
+WordRecordModes = OutputModes + ('word', 'bdol')
+StoredModes = frozenset(WordRecordModes)
+
+##
+# Renders a word as SyrWordToOutputs does, returning it as WordRecordModes,
+# so the key and BDOL flag come from the same pass as the outputs. Takes the
+# same arguments as SyrWordToOutputs, for use as a render; modes is always
+# WordRecordModes.
+def SyrWordToRecord(word, modes, dictionary, verbose, scheme):
+    outputs, key, is_bdol = RenderWord(word, OutputModes, dictionary, verbose, scheme, True)
+    return outputs + (key, is_bdol)
+
+class WordCache:
+    ##
+    # A size-bounded LRU cache of transliterated words.
+    # Entries are keyed on (word, dictionary identity, character scheme, output
+    # modes) and hold the tuple of outputs produced by SyrWordToOutputs.
+    #
+    # maxsize: int - the number of words kept before the least recently used is evicted
+    def __init__(self, maxsize = 65536):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+
+    def __len__(self):
+        return len(self._entries)
+
+    # render: func - renders missing words in place of SyrWordToOutputs, taking the same arguments
+    def Lookup(self, word, dictionary=None, modes=OutputModes, scheme=None, render=None):
+        key = (word, id(dictionary) if dictionary else None, (scheme or DefaultScheme).key, modes)
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            entry = (render or SyrWordToOutputs)(word, modes, dictionary, False, scheme)
+            self._entries[key] = entry
+            if len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+        else:
+            self.hits += 1
+            self._entries.move_to_end(key)
+        return entry
+
+    def Clear(self):
+        self._entries.clear()
+
+    def Stats(self):
+        return {'size': len(self._entries), 'maxsize': self.maxsize,
+                'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions}
+
+# what TransliterationStats counts, and the stages it times as '<stage>_seconds'
+StatsCounters = ('chars', 'words', 'tokens', 'unknown_chars', 'bdol_hits', 'vocalized_words', 'cache_hits', 'cache_misses')
+StatsStages = ('segment', 'render', 'assemble')
+
+def NewStatsRecord():
+    record = dict.fromkeys(StatsCounters, 0)
+    for stage in StatsStages:
+        record[stage + '_seconds'] = 0.0
+    record['total_seconds'] = 0.0
+    return record
+
+class TransliterationStats:
+    ##
+    # Counters and per-stage timers of a Transliterator created with stats,
+    # totalled over all of its calls. Transliterators without stats never
+    # touch any of this.
+    #
+    # Hooks added with Subscribe are called after every transliterate call
+    # (or stream block) with a record of that call alone: the StatsCounters,
+    # a '<stage>_seconds' timer for each of StatsStages and total_seconds.
+    # Services embedding syr2ipa can feed these into their own metrics.
+    def __init__(self):
+        self.totals = NewStatsRecord()
+        self.calls = 0
+        self._hooks = []
+
+    def Subscribe(self, hook):
+        self._hooks.append(hook)
+
+    def Unsubscribe(self, hook):
+        self._hooks.remove(hook)
+
+    def Record(self, record):
+        self.calls += 1
+        totals = self.totals
+        for field, value in record.items():
+            totals[field] += value
+        for hook in self._hooks:
+            hook(record)
+
+    def Stats(self):
+        return dict(self.totals, calls=self.calls)
+
+    def Summary(self):
+        totals = self.totals
+        total = totals['total_seconds']
+        rate = f' ({totals["chars"] / total:,.0f} chars/sec)' if total else ''
+        lines = [f'syr2ipa stats: {totals["chars"]:,} chars, {totals["words"]:,} words in {total:.3f}s{rate}',
+                 f'  tokens: {totals["tokens"]:,}  unknown chars: {totals["unknown_chars"]:,}  '
+                 f'BDOL hits: {totals["bdol_hits"]:,}  vocalized: {totals["vocalized_words"]:,}  '
+                 f'cache hits: {totals["cache_hits"]:,}  '
+                 f'cache misses: {totals["cache_misses"]:,}']
+        staged = 0.0
+        for stage in StatsStages + ('other',):
+            if stage == 'other':
+                seconds = total - staged
             else:
-                if letter.name == 'ALAP_WEST':
-                    ipa = 'o'
-                    latin = 'o'
-                else:    
-                    ipa = 'ɑ'
-                    latin = 'a'
-        elif (next_token is None or next_token.base is None) or next_token.punctuation:
-            if previous_token and previous_token.vowel and (previous_token.vowel.name == 'ZQAPPA' or previous_token.vowel.name == 'PTAKHA' or previous_token.vowel.name == 'ZLAMA_KIRYA' or previous_token.vowel.name == 'ZLAMA_YARIKHA'):
-                ipa = ''
-                latin = ''
-        elif next_token and previous_token:
-            if previous_token.base and next_token.base:
-                ipa = ''
-                latin = ''
+                seconds = totals[stage + '_seconds']
+                staged += seconds
+            share = 100 * seconds / total if total else 0.0
+            lines.append(f'  {stage + ":":<10} {seconds * 1000:>10.1f} ms {share:>5.1f}%')
+        return '\n'.join(lines)
+
+##
+# SyrWordToOutputs counting into a stats record; words are not timed one by
+# one, the render stage of a call covers them all. Given WordRecordModes, it
+# renders a word record as SyrWordToRecord does.
+def SyrWordToOutputsWithStats(word, modes, dictionary, verbose, scheme, record):
+    if modes == WordRecordModes:
+        outputs, key, is_bdol = RenderWord(word, OutputModes, dictionary, verbose, scheme, True, record)
+        return outputs + (key, is_bdol)
+    return RenderWord(word, modes, dictionary, verbose, scheme, False, record)[0]
+
+# runs of whitespace, captured so that splitting on them keeps them
+WhitespaceRuns = re.compile(r'(\s+)')
+
+##
+# Transliterates a string into each of the requested output modes, returning
+# one string per mode. Words are separated by runs of any whitespace, which
+# are copied to the output verbatim.
+#
+# render: func - renders words in place of SyrWordToOutputs, taking the same arguments
+def SyrStrToOutputs(syrStr, modes=OutputModes, dictionary=None, verbose=False, cache=None, scheme=None, render=None):
+    # words at the even indexes, the whitespace between them at the odd ones
+    pieces = WhitespaceRuns.split(syrStr)
+    words = pieces[0::2]
+    if cache is None or verbose:
+        render = render or SyrWordToOutputs
+        wordOutputs = [render(word, modes, dictionary, verbose, scheme) for word in words]
+    else:
+        lookup = cache.Lookup
+        wordOutputs = [lookup(word, dictionary, modes, scheme, render) for word in words]
+
+    outputs = []
+    for i in range(len(modes)):
+        pieces[0::2] = [wordOutput[i] for wordOutput in wordOutputs]
+        outputs.append(''.join(pieces))
+    return tuple(outputs)
+
+def SyrStrStrToIPA(syrStr, dictionary=None, verbose=False, cache=None):
+    return SyrStrToOutputs(syrStr, OutputModes, dictionary, verbose, cache)
+
+##
+# Loads a corpus dictionary, either a compiled one (see CompiledDictionary) or
+# a JSON object of words.
+def LoadDictionary(path):
+    with open(path, 'rb') as inputDict:
+        isCompiled = inputDict.read(len(CompiledDictionaryMagic)) == CompiledDictionaryMagic
+    if isCompiled:
+        return CompiledDictionary(path)
+    with open(path, 'r') as inputDict:
+        return json.load(inputDict)
+
+CompiledDictionaryMagic = b'SYRDICT1'
+# magic, word count, bucket count, words offset, values offset
+CompiledDictionaryHeader = struct.Struct('<8sIIII')
+CompiledDictionaryField = struct.Struct('<I')
+
+class CompiledDictionary:
+    ##
+    # A read-only corpus dictionary memory-mapped from a file written by
+    # CompileDictionary, so opening it reads nothing up front and processes
+    # mapping the same file share its pages. Words are looked up in O(1)
+    # through an open addressing hash index.
+    #
+    # Layout, all integers little-endian uint32:
+    #   header:  CompiledDictionaryHeader
+    #   buckets: bucket count entries of word index + 1, 0 when empty; a word's
+    #            home bucket is the crc32 of its UTF-8 bytes, probed linearly
+    #   words:   word count + 1 offsets, then the UTF-8 words sorted by bytes
+    #   values:  word count + 1 offsets, then each word's value as JSON
+    #
+    # path: str - the path of the compiled dictionary
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as dictFile:
+            self._map = mmap.mmap(dictFile.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, self._count, buckets, self._words, self._values = CompiledDictionaryHeader.unpack_from(self._map)
+        if magic != CompiledDictionaryMagic:
+            raise ValueError(f'not a compiled dictionary: {path}')
+        self._mask = buckets - 1
+        self._buckets = CompiledDictionaryHeader.size
+        self._wordData = self._words + (self._count + 1) * CompiledDictionaryField.size
+        self._valueData = self._values + (self._count + 1) * CompiledDictionaryField.size
+
+    def __reduce__(self):
+        return CompiledDictionary, (self.path,)
+
+    def __len__(self):
+        return self._count
+
+    def __contains__(self, word):
+        return self._Find(word.encode('utf-8')) >= 0
+
+    def __getitem__(self, word):
+        index = self._Find(word.encode('utf-8'))
+        if index < 0:
+            raise KeyError(word)
+        start, end = self._Span(self._values, self._valueData, index)
+        return json.loads(self._map[start:end])
+
+    def get(self, word, default = None):
+        try:
+            return self[word]
+        except KeyError:
+            return default
+
+    def keys(self):
+        for index in range(self._count):
+            start, end = self._Span(self._words, self._wordData, index)
+            yield self._map[start:end].decode('utf-8')
+
+    __iter__ = keys
+
+    def close(self):
+        self._map.close()
+
+    def _Span(self, offsets, data, index):
+        unpack = CompiledDictionaryField.unpack_from
+        position = offsets + index * CompiledDictionaryField.size
+        return data + unpack(self._map, position)[0], data + unpack(self._map, position + CompiledDictionaryField.size)[0]
+
+    def _Find(self, key):
+        if self._count == 0:
+            return -1
+        unpack = CompiledDictionaryField.unpack_from
+        bucket = zlib.crc32(key) & self._mask
+        while True:
+            entry = unpack(self._map, self._buckets + bucket * CompiledDictionaryField.size)[0]
+            if entry == 0:
+                return -1
+            start, end = self._Span(self._words, self._wordData, entry - 1)
+            if self._map[start:end] == key:
+                return entry - 1
+            bucket = (bucket + 1) & self._mask
+
+    def items(self):
+        for index in range(self._count):
+            start, end = self._Span(self._words, self._wordData, index)
+            valueStart, valueEnd = self._Span(self._values, self._valueData, index)
+            yield self._map[start:end].decode('utf-8'), json.loads(self._map[valueStart:valueEnd])
+
+##
+# Converts a JSON corpus dictionary into the compiled format read by
+# CompiledDictionary, along with its skeleton index (see SkeletonIndexPath).
+def CompileDictionary(jsonPath, outputPath):
+    with open(jsonPath, 'r') as inputDict:
+        dictionary = json.load(inputDict)
+
+    WriteCompiledDictionary(dictionary, outputPath)
+    WriteCompiledDictionary(BuildSkeletonIndex(dictionary), SkeletonIndexPath(outputPath))
+
+##
+# Writes a dict of words to JSON values in the compiled format.
+def WriteCompiledDictionary(dictionary, outputPath):
+    encode = json.JSONEncoder(ensure_ascii=False).encode
+    entries = sorted((word.encode('utf-8'), encode(value).encode('utf-8')) for word, value in dictionary.items())
+    count = len(entries)
+    buckets = 1
+    while buckets < count * 2:
+        buckets <<= 1
+
+    index = [0] * buckets
+    for i, (word, _) in enumerate(entries):
+        bucket = zlib.crc32(word) & (buckets - 1)
+        while index[bucket]:
+            bucket = (bucket + 1) & (buckets - 1)
+        index[bucket] = i + 1
+
+    def Section(blobs):
+        offsets = [0]
+        for blob in blobs:
+            offsets.append(offsets[-1] + len(blob))
+        if offsets[-1] > 0xffffffff:
+            raise ValueError('dictionary too large for the compiled format')
+        return struct.pack(f'<{len(offsets)}I', *offsets) + b''.join(blobs)
+
+    words = Section([word for word, _ in entries])
+    values = Section([value for _, value in entries])
+    wordsOffset = CompiledDictionaryHeader.size + buckets * CompiledDictionaryField.size
+    valuesOffset = wordsOffset + len(words)
+
+    with open(outputPath, 'wb') as outputDict:
+        outputDict.write(CompiledDictionaryHeader.pack(CompiledDictionaryMagic, count, buckets, wordsOffset, valuesOffset))
+        outputDict.write(struct.pack(f'<{buckets}I', *index))
+        outputDict.write(words)
+        outputDict.write(values)
+
+# what is left of a word once its vowels and diacritics are stripped
+NonSkeletonChars = re.compile('[^' + ''.join(WordKeyLetters) + ']')
+WordKeyVowelChars = re.compile('[' + ''.join(WordKeyVowels) + ']')
+BdolLetters = ('ܒ', 'ܕ', 'ܘ', 'ܠ')
+
+##
+# The consonant skeleton of a word, the letters an unpointed text spells it with.
+def WordSkeleton(word):
+    return NonSkeletonChars.sub('', word)
+
+##
+# Maps the skeleton of every vocalized word of a corpus dictionary to its
+# vocalized forms, the most frequent first. A word's frequency is its value
+# in the dictionary when that is a number, and 1 otherwise.
+def BuildSkeletonIndex(dictionary):
+    frequencies = {}
+    for word, value in dictionary.items():
+        if WordKeyVowelChars.search(word) is None:
+            continue
+        frequency = value if isinstance(value, (int, float)) and not isinstance(value, bool) else 1
+        frequencies.setdefault(WordSkeleton(word), []).append((word, frequency))
+    return {skeleton: [word for word, _ in sorted(forms, key=lambda form: -form[1])]
+            for skeleton, forms in frequencies.items()}
+
+##
+# The path of the skeleton index compiled next to a compiled dictionary.
+def SkeletonIndexPath(dictionaryPath):
+    return dictionaryPath + '.skeletons'
+
+class SkeletonIndex:
+    ##
+    # Vocalizes unpointed words from the consonant skeletons of a corpus
+    # dictionary, as built by BuildSkeletonIndex.
+    #
+    # index: dict or CompiledDictionary - skeleton -> vocalized forms, the most frequent first
+    def __init__(self, index):
+        self.index = index
+
+    def __len__(self):
+        return len(self.index)
+
+    ##
+    # The vocalized forms of a word's skeleton, the most frequent first.
+    def Forms(self, word):
+        return self.index.get(WordSkeleton(word)) or []
+
+    ##
+    # Returns the word with its letters replaced by the most frequent
+    # vocalized form of its skeleton, keeping any punctuation around them.
+    # A word behind a BDOL prefix letter is vocalized after the prefix.
+    # Words that already have a vowel, or whose skeleton is unknown, are
+    # returned as they are.
+    def Vocalize(self, word):
+        key = CleanUpWord(word)
+        if not key or WordKeyVowelChars.search(key) is not None:
+            return word
+
+        skeleton = WordSkeleton(key)
+        prefix = ''
+        forms = self.index.get(skeleton)
+        if not forms and len(skeleton) > 1 and skeleton[0] in BdolLetters:
+            prefix = skeleton[0]
+            forms = self.index.get(skeleton[1:])
+        if not forms:
+            return word
+
+        vocalized = prefix + forms[0]
+
+        if key == word:
+            return vocalized
+        # the letters must be contiguous for the punctuation around them to be kept
+        return word.replace(key, vocalized, 1) if key in word else word
+
+##
+# Returns the skeleton index of a corpus dictionary: the one compiled next to
+# a CompiledDictionary, or else one built in memory.
+def LoadSkeletonIndex(dictionary):
+    if isinstance(dictionary, CompiledDictionary) and os.path.isfile(SkeletonIndexPath(dictionary.path)):
+        return SkeletonIndex(CompiledDictionary(SkeletonIndexPath(dictionary.path)))
+    return SkeletonIndex(BuildSkeletonIndex(dictionary))
+
+# bump whenever the layout of a saved ReverseIndex, or the search forms it holds, change
+ReverseIndexVersion = 2
+# what a search form drops besides modifier letters: anything but letters and
+# digits, and the IPA glottal stop and pharyngeal, which spell alap and ayin
+# as the latin ʿ and ' do, so that 'al, ʿal and ʕal all search as al
+NonSearchChars = re.compile(r'[\W_ʔʕ]+')
+# the vowels dropped from the vowel-stripped forms, latin and IPA
+SearchVowels = re.compile('[aeiouɑɐæɛəɪɔʊʌ]+')
+
+##
+# Reduces a latin or IPA string to the form it is searched by: without case,
+# accents, apostrophes and other modifier letters (ʿ, ː, ˈ, ...), the glottal
+# stop and pharyngeal, punctuation and whitespace.
+def NormalizeSearchForm(text):
+    decomposed = unicodedata.normalize('NFKD', text.casefold())
+    return NonSearchChars.sub('', ''.join([char for char in decomposed
+                                           if not unicodedata.combining(char) and unicodedata.category(char) != 'Lm']))
+
+##
+# The vowel-stripped form of a normalized search form, which matches however
+# the vowels of a word were spelt, or left out.
+def StripSearchVowels(form):
+    return SearchVowels.sub('', form)
+
+class ReverseIndex:
+    ##
+    # An inverted index from the IPA and latin transliterations of Syriac words
+    # back to the words, so that a latin or IPA query ("dyama", "sehla") is a
+    # pair of dict lookups rather than a pass over the transliterated corpus.
+    #
+    # Every word is transliterated once, when it is added, into each of
+    # OutputModes. Each output is indexed by its NormalizeSearchForm and by
+    # that form with its vowels stripped.
+    #
+    # scheme:     Scheme - the character scheme words are transliterated with
+    # dictionary: dict - a corpus dictionary used for BDOL detection
+    def __init__(self, scheme = None, dictionary = None):
+        self.scheme = scheme or DefaultScheme
+        self.dictionary = dictionary
+        self.words = set()
+        self.forms = {}
+        self.skeletons = {}
+
+    def __len__(self):
+        return len(self.words)
+
+    def __contains__(self, word):
+        return CleanUpWord(word) in self.words
+
+    ##
+    # Indexes Syriac words not indexed yet, returning how many were added.
+    # Words are reduced to their dictionary keys (see CleanUpWord) first.
+    def Add(self, words):
+        added = 0
+        indexed = self.words
+        for word in words:
+            word = CleanUpWord(word)
+            if not word or word in indexed:
+                continue
+            indexed.add(word)
+            added += 1
+            for output in SyrWordToOutputs(word, OutputModes, self.dictionary, False, self.scheme):
+                form = NormalizeSearchForm(output)
+                if form:
+                    self._Insert(self.forms, form, word)
+                    self._Insert(self.skeletons, StripSearchVowels(form) or form, word)
+        return added
+
+    ##
+    # Indexes the words of running text, as split by SyrStrToOutputs.
+    def AddText(self, text):
+        return self.Add(WhitespaceRuns.split(text)[0::2])
+
+    ##
+    # Returns the Syriac words a latin or IPA query matches: those with an
+    # output of the same normalized form first, then, with vowels, those
+    # matching it once vowels are stripped from both.
+    #
+    # query:  str - a latin or IPA word
+    # vowels: bool - also match words by their vowel-stripped forms
+    def Lookup(self, query, vowels = True):
+        form = NormalizeSearchForm(query)
+        matches = list(self.forms.get(form, ()))
+        if vowels and form:
+            matches = list(dict.fromkeys(chain(matches, self.skeletons.get(StripSearchVowels(form) or form, ()))))
+        return matches
+
+    ##
+    # Writes the index to a file, replacing it only once it is complete.
+    def Save(self, path):
+        partialPath = f'{path}.{os.getpid()}'
+        with open(partialPath, 'wb') as indexFile:
+            marshal.dump((ReverseIndexVersion, self.scheme.key, self.words, self.forms, self.skeletons), indexFile)
+        os.replace(partialPath, path)
+
+    # Add indexes a word's outputs one after the other, so the only
+    # duplicate can be the word last appended
+    def _Insert(self, index, form, word):
+        words = index.get(form)
+        if words is None:
+            index[form] = [word]
+        elif words[-1] != word:
+            words.append(word)
+
+##
+# Loads an index written by ReverseIndex.Save. Words added to it afterwards
+# are transliterated with scheme, which must be the one it was built with.
+def LoadReverseIndex(path, scheme = None, dictionary = None):
+    index = ReverseIndex(scheme, dictionary)
+    with open(path, 'rb') as indexFile:
+        try:
+            version, key, index.words, index.forms, index.skeletons = marshal.loads(indexFile.read())
+        except (EOFError, ValueError, TypeError):
+            raise ValueError(f'not a reverse index: {path}')
+    if version != ReverseIndexVersion:
+        raise ValueError(f'reverse index {path} has an unsupported version: {version}')
+    if key != index.scheme.key:
+        raise ValueError(f'reverse index {path} was built with another character scheme')
+    return index
+
+# bump whenever the engine renders a word differently under the same scheme and dictionary
+WordStoreVersion = 3
+# new words a WordStore holds before writing them out
+WordStoreBatch = 4096
+
+##
+# A hash of a corpus dictionary, for keying stored transliterations on it.
+# Dictionaries loaded from a file are keyed on the file's bytes, given its
+# path or as a CompiledDictionary, so no run pays for serializing a large
+# dictionary again; only in-memory dicts are hashed word by word.
+def DictionaryKey(dictionary):
+    if not dictionary:
+        return ''
+    if isinstance(dictionary, CompiledDictionary):
+        return hashlib.sha256(dictionary._map).hexdigest()
+    if isinstance(dictionary, str):
+        digest = hashlib.sha256()
+        with open(dictionary, 'rb') as dictFile:
+            for chunk in iter(lambda: dictFile.read(1 << 20), b''):
+                digest.update(chunk)
+        return digest.hexdigest()
+    encode = json.JSONEncoder(ensure_ascii=False, sort_keys=True).encode
+    return hashlib.sha256(encode(dictionary).encode('utf-8')).hexdigest()
+
+class WordStore:
+    ##
+    # A persistent word -> outputs store in SQLite, so that runs over the same
+    # vocabulary do not start cold. Any number of processes may read and
+    # write a store at once.
+    #
+    # Words are stored as records of WordRecordModes, their output in every
+    # one of OutputModes with their dictionary key and BDOL flag, under a
+    # version: the hash of WordStoreVersion, the character scheme and the
+    # corpus dictionary, and whether unpointed words are vocalized. Entries of
+    # other versions are never read, so changing any of these invalidates them.
+    #
+    # Reading a row per word costs as much as rendering the word, so new
+    # words are written out WordStoreBatch at a time as one marshalled row,
+    # and all the rows of a version are loaded into memory when the store is
+    # opened (see Preload). Past maxsize entries, the rows of the versions
+    # used longest ago, and within a version the oldest rows, are evicted.
+    #
+    # path:    str - the SQLite file, created if needed
+    # version: str - the version of the entries to read and write (see WordStoreKey)
+    # maxsize: int - the number of entries kept, over all versions
+    def __init__(self, path, version, maxsize = 1 << 20):
+        self.path = path
+        self.version = version
+        self.maxsize = maxsize
+        self.entries = {}
+        self._pending = {}
+        self._connection = None
+        self._pid = None
+        self.Preload()
+
+    def __len__(self):
+        return len(self.entries)
+
+    ##
+    # Loads the entries of this version, up to maxsize of them, into memory
+    # and marks them used by this run.
+    def Preload(self):
+        connection = self._Connect()
+        for entries, in connection.execute('SELECT entries FROM batches WHERE version = ? ORDER BY id', (self.version,)):
+            try:
+                self.entries.update(marshal.loads(entries))
+            except (EOFError, ValueError, TypeError):
+                continue
+            if len(self.entries) >= self.maxsize:
+                break
+        with connection:
+            connection.execute('UPDATE batches SET used = ? WHERE version = ?', (int(time.time()), self.version))
+
+    def Get(self, word):
+        return self.entries.get(word)
+
+    def Put(self, word, outputs):
+        if len(self.entries) < self.maxsize:
+            self.entries[word] = outputs
+        self._pending[word] = outputs
+        if len(self._pending) >= WordStoreBatch:
+            self.Flush()
+
+    ##
+    # Writes out the new words, then evicts past maxsize. The store is only a
+    # cache: when it cannot be written, the words are dropped.
+    def Flush(self):
+        if not self._pending:
+            return
+        import sqlite3
+        entries = marshal.dumps(self._pending)
+        count = len(self._pending)
+        self._pending = {}
+        try:
+            connection = self._Connect()
+            with connection:
+                connection.execute('INSERT INTO batches (version, words, used, entries) VALUES (?, ?, ?, ?)',
+                                   (self.version, count, int(time.time()), entries))
+                excess = connection.execute('SELECT sum(words) FROM batches').fetchone()[0] - self.maxsize
+                evicted = []
+                for batch, words in connection.execute('SELECT id, words FROM batches ORDER BY used, id'):
+                    if excess <= 0:
+                        break
+                    evicted.append((batch,))
+                    excess -= words
+                connection.executemany('DELETE FROM batches WHERE id = ?', evicted)
+        except sqlite3.Error:
+            pass
+
+    def Close(self):
+        self.Flush()
+        if self._connection is not None and self._pid == os.getpid():
+            self._connection.close()
+        self._connection = None
+
+    # a connection of this process; one inherited over fork is not used
+    # pickled for worker processes without the connection, which each opens anew
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_connection'] = state['_pid'] = None
+        return state
+
+    def _Connect(self):
+        if self._connection is None or self._pid != os.getpid():
+            # imported here so that runs without a store do not pay for loading it
+            import sqlite3
+            connection = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+            connection.execute('PRAGMA journal_mode = WAL')
+            with connection:
+                connection.execute('CREATE TABLE IF NOT EXISTS batches (id INTEGER PRIMARY KEY, version TEXT NOT NULL, '
+                                   'words INTEGER NOT NULL, used INTEGER NOT NULL, entries BLOB NOT NULL)')
+                connection.execute('CREATE INDEX IF NOT EXISTS batches_version ON batches (version)')
+            self._connection, self._pid = connection, os.getpid()
+        return self._connection
+
+##
+# The WordStore version of the entries a transliterator would render.
+#
+# dictionary: the corpus dictionary, or the path it was loaded from (see DictionaryKey)
+def WordStoreKey(scheme = None, dictionary = None, unvocalized = False):
+    key = f'{WordStoreVersion}\0{(scheme or DefaultScheme).key}\0{DictionaryKey(dictionary)}\0{bool(unvocalized)}'
+    return hashlib.sha256(key.encode('utf-8')).hexdigest()
+
+# characters read per chunk and bytes buffered per write in stream mode
+StreamChunkSize = 1 << 20
+StreamBufferSize = 1 << 20
+# characters per block handed to each worker process with --jobs
+ParallelChunkSize = 1 << 16
+
+class Transliterator:
+    ##
+    # mode:       str - the output to produce, one of the scheme's modes ('ipa', 'latin', ...); only this one is computed
+    # dictionary: dict or str - a corpus dictionary (dict or CompiledDictionary), or the path of a JSON or compiled one, used for BDOL detection
+    # verbose:    bool - print the parsed characters of every word
+    # cache_size: int - the number of distinct words to memoize, 0 disables the cache
+    # scheme:     Scheme or str - the character scheme, or the name or JSON path of one (see GetScheme)
+    # stats:      TransliterationStats or bool - gather counters and stage timers into this, or a new one if True
+    # unvocalized: SkeletonIndex or bool - vocalize unpointed words from this, or from the dictionary's if True
+    # store:      WordStore or str - keep words across runs in this, or in a WordStore at this path
+    def __init__(self, mode = 'ipa', dictionary = None, verbose = False, cache_size = 65536, scheme = None, stats = None,
+                 unvocalized = None, store = None):
+        # a dictionary loaded here is keyed in the store on its file
+        dictionaryKey = dictionary
+        if isinstance(dictionary, str):
+            dictionary = LoadDictionary(dictionary)
+        if unvocalized is True:
+            if not dictionary:
+                raise ValueError('unvocalized transliteration needs a corpus dictionary')
+            unvocalized = LoadSkeletonIndex(dictionary)
+        if scheme is None:
+            scheme = DefaultScheme
+        elif isinstance(scheme, str):
+            scheme = GetScheme(scheme)
+        if mode not in scheme.modes:
+            raise ValueError(f'unknown output mode: {mode}')
+        if stats is True:
+            stats = TransliterationStats()
+        if isinstance(store, str):
+            store = WordStore(store, WordStoreKey(scheme, dictionaryKey, unvocalized))
+
+        self.mode = mode
+        self.dictionary = dictionary
+        self.verbose = verbose
+        self.scheme = scheme
+        self.stats = stats or None
+        self.skeletons = unvocalized or None
+        self.cache = WordCache(cache_size) if cache_size > 0 else None
+        self.store = store
+        self._modes = (mode,)
+        self._renderWord = SyrWordToOutputs if self.skeletons is None else self._RenderUnvocalized
+        self._render = self._renderWord if store is None else self._RenderStored
+
+    def transliterate(self, text):
+        if self.stats is None:
+            return SyrStrToOutputs(text, self._modes, self.dictionary, self.verbose, self.cache, self.scheme,
+                                   self._render)[0]
+        output, record = self._TransliterateWithStats(text)
+        self.stats.Record(record)
+        return output
+
+    ##
+    # Transliterates many strings, lazily yielding their outputs in order.
+    # Strings are read batch_size at a time; within a batch every distinct
+    # string, and every distinct word across all of them, is transliterated
+    # once. With stats or verbose on, each string goes through transliterate.
+    def transliterate_many(self, texts, batch_size = 4096):
+        if self.stats is not None or self.verbose:
+            for text in texts:
+                yield self.transliterate(text)
+            return
+
+        texts = iter(texts)
+        while True:
+            batch = list(islice(texts, batch_size))
+            if not batch:
+                return
+            yield from self._TransliterateBatch(batch)
+
+    def _TransliterateBatch(self, batch):
+        split = WhitespaceRuns.split
+        pieces = {text: split(text) for text in batch}
+        words = dict.fromkeys(chain.from_iterable([textPieces[0::2] for textPieces in pieces.values()]))
+
+        modes, dictionary, scheme, render = self._modes, self.dictionary, self.scheme, self._render
+        if self.cache is None:
+            rendered = {word: render(word, modes, dictionary, False, scheme)[0] for word in words}
         else:
-            ipa = letter.ipa
-            latin = letter.latin
+            lookup = self.cache.Lookup
+            rendered = {word: lookup(word, dictionary, modes, scheme, render)[0] for word in words}
+
+        outputs = {}
+        for text, textPieces in pieces.items():
+            textPieces[0::2] = map(rendered.__getitem__, textPieces[0::2])
+            outputs[text] = ''.join(textPieces)
+        return map(outputs.__getitem__, batch)
 
-    elif letter.character == 'ܗ':
-        if (next_token is None or next_token.base is None) and previous_token and previous_token.vowel and (previous_token.vowel.name == 'ZQAPPA' or previous_token.vowel.name == 'PTAKHA' or previous_token.vowel.name == 'ZLAMA_KIRYA' or previous_token.vowel.name == 'ZLAMA_YARIKHA'):
-            ipa = ''
-            latin = ''
+    ##
+    # transliterate, timing and counting its stages into a new stats record.
+    # Returns the output and the record.
+    def _TransliterateWithStats(self, text):
+        perf_counter = time.perf_counter
+        record = NewStatsRecord()
+        start = perf_counter()
+
+        pieces = WhitespaceRuns.split(text)
+        words = pieces[0::2]
+        segmented = perf_counter()
+
+        skeletons = self.skeletons
+
+        def render(word, modes, dictionary, verbose, scheme):
+            if skeletons is not None:
+                vocalized = skeletons.Vocalize(word)
+                record['vocalized_words'] += vocalized is not word
+                word = vocalized
+            return SyrWordToOutputsWithStats(word, modes, dictionary, verbose, scheme, record)
+
+        if self.store is not None:
+            renderWord = render
+
+            def render(word, modes, dictionary, verbose, scheme):
+                return self._RenderStored(word, modes, dictionary, verbose, scheme, renderWord)
+
+        # the empty words before leading and after trailing whitespace are not counted
+        if self.cache is None or self.verbose:
+            wordOutputs = [render(word, self._modes, self.dictionary, self.verbose, self.scheme) if word else ('',)
+                           for word in words]
         else:
-            ipa = letter.ipa
-            latin = letter.latin
+            hits, misses = self.cache.hits, self.cache.misses
+            lookup = self.cache.Lookup
+            wordOutputs = [lookup(word, self.dictionary, self._modes, self.scheme, render) if word else ('',)
+                           for word in words]
+            record['cache_hits'] = self.cache.hits - hits
+            record['cache_misses'] = self.cache.misses - misses
+        rendered = perf_counter()
+
+        pieces[0::2] = [wordOutput[0] for wordOutput in wordOutputs]
+        output = ''.join(pieces)
+        end = perf_counter()
+
+        record['chars'] = len(text)
+        record['words'] = len(words) - words.count('')
+        record['segment_seconds'] = segmented - start
+        record['render_seconds'] = rendered - segmented
+        record['assemble_seconds'] = end - rendered
+        record['total_seconds'] = end - start
+        return output, record
 
-    elif letter.character == 'ܝ':
-        if (previous_token is None or previous_token.base is None) and next_token.base and (next_token.base.character == 'ܘ' or next_token.base.character == 'ܗ'):
-            ipa = 'i'
-            latin = 'i'
+    ##
+    # Transliterates a text stream in bounded memory, yielding the output in
+    # large blocks (see SplitStreamBlocks). Every input line produces one
+    # output line.
+    #
+    # jobs > 1 fans the blocks out to a pool of worker processes and yields
+    # their results in input order; jobs = 0 uses one worker per core.
+    def transliterate_stream(self, inputStream, chunk_size = None, jobs = 1):
+        if jobs < 0:
+            raise ValueError(f'jobs must be 0 or more: {jobs}')
+        if jobs == 0:
+            jobs = os.cpu_count() or 1
+        if chunk_size is None:
+            chunk_size = StreamChunkSize if jobs == 1 else ParallelChunkSize
+
+        blocks = SplitStreamBlocks(inputStream, chunk_size)
+        if jobs == 1:
+            for block in blocks:
+                yield self.transliterate(block)
+            self.flush()
+            return
+
+        # so that workers do not inherit words waiting to be stored
+        self.flush()
+
+        # workers receive this transliterator once at start up; under fork it is
+        # inherited along with the character tables and dictionary, not pickled;
+        # under spawn it is pickled, its store leaving its connection behind
+        if 'fork' in multiprocessing.get_all_start_methods():
+            context = multiprocessing.get_context('fork')
         else:
-            ipa = letter.ipa
-            latin = letter.latin
-
-    return ipa, latin
-
-def ModifierRukakha(letter, previous_token, t, next_token):
-    ipa   = letter.ipa
-    latin = letter.latin
-
-    if letter.character == 'ܒ':
-        ipa = 'w'
-        latin = 'w'
-    elif letter.character == 'ܓ':
-        ipa = 'ɣ'
-        latin = 'gh'
-    elif letter.character == 'ܕ':
-        ipa = 'ð'
-        latin = 'dh'
-    elif letter.character == 'ܟ':
-        ipa = 'x'
-        latin = 'kh'
-    elif letter.character == 'ܦ':
-        ipa = 'f'
-        latin = 'f'
-    elif letter.character == 'ܬ':
-        ipa = 'θ'
-        latin = 'th'
-    
-    return ipa, latin
+            context = multiprocessing.get_context()
+
+        with context.Pool(jobs, _InitWorker, (self,)) as pool:
+            pending = deque()
+            for block in blocks:
+                pending.append(pool.apply_async(_TransliterateWorkerBlock, (block,)))
+                # keep a bounded number of blocks in flight so memory stays flat
+                if len(pending) >= jobs * 2:
+                    yield self._CollectWorkerBlock(pending.popleft().get())
+            while pending:
+                yield self._CollectWorkerBlock(pending.popleft().get())
 
-def ModifierRukakhaSemiCircle(letter, previous_token, t, next_token):
-    ipa   = letter.ipa
-    latin = letter.latin
+    ##
+    # Transliterates a text into one record per word, for loading into search
+    # indexes and aligners without reparsing the output. A record is a tuple
+    # of WordRecordFields: the span of the word in text, in characters and
+    # shifted by offset, its dictionary key (see CleanUpWord), whether it was
+    # read as a BDOL, and its IPA and latin forms, both rendered whatever the
+    # mode. Every distinct word is transliterated once, and its record is
+    # kept in the word cache and store like its outputs. Under unvocalized,
+    # the key and BDOL flag are those of the word as vocalized.
+    def word_records(self, text, offset = 0):
+        pieces = WhitespaceRuns.split(text)
+        words = dict.fromkeys(pieces[0::2])
+        words.pop('', None)
+
+        modes, dictionary, scheme = WordRecordModes, self.dictionary, self.scheme
+        render = self._RenderRecord if self.store is None else self._RenderStored
+        if self.cache is None:
+            rendered = {word: render(word, modes, dictionary, False, scheme) for word in words}
+        else:
+            lookup = self.cache.Lookup
+            rendered = {word: lookup(word, dictionary, modes, scheme, render) for word in words}
+
+        records = []
+        append = records.append
+        position = offset
+        isWord = True
+        for piece in pieces:
+            end = position + len(piece)
+            # words at the even indexes, the whitespace between them at the odd ones
+            if isWord and piece:
+                ipa, latin, key, is_bdol = rendered[piece]
+                append((position, end, key, is_bdol, ipa, latin))
+            position = end
+            isWord = not isWord
+        return records
 
-    if letter.character == 'ܦ':
-        ipa = 'f'
-        latin = 'f'
-    
-    return ipa, latin
-
-def ModifierTalqana(letter, previous_token, t, next_token):
-    return '', ''
-
-def ModifierQanunaTop(letter, previous_token, t, next_token):
-    ipa   = letter.ipa
-    latin = letter.latin
-
-    if letter.character == 'ܡ' and t.vowel is None:
-        ipa = f'{ipa}ɑ'.format(ipa=letter.ipa)
-        latin = f'{latin}a'.format(latin=letter.latin)
-
-    if letter.character == 'ܗ' and previous_token and previous_token.vowel is None:
-        ipa = f'ɑ{ipa}'.format(ipa=letter.ipa)
-        latin = f'a{latin}'.format(latin=letter.latin)
-
-    return ipa, latin
-
-def ModifierQanunaBottom(letter, previous_token, t, next_token):
-    ipa   = letter.ipa
-    latin = letter.latin
-
-    if letter.character == 'ܡ' and t.vowel is None:
-        ipa = f'{ipa}ɪ'.format(ipa=letter.ipa)
-        latin = f'{latin}i'.format(latin=letter.latin)
-
-    return ipa, latin
-
-alap = SyrChar('ALAP', 'ܐ', is_letter = True, is_matres = True, modifier_function=ModifierMatres, latin = 'a', ipa = 'ʔ')
-alap_west = SyrChar('ALAP_WEST', 'ܐ', is_letter = True, latin = 'o', ipa = 'ʔ')
-beth = SyrChar('BETH', 'ܒ', is_letter = True, latin = 'b', ipa = 'b')
-gammal = SyrChar('GAMMAL', 'ܓ', is_letter = True, latin = 'g', ipa = 'g')
-gammal_garshuni = SyrChar('GAMMAL_GARSHUNI', 'ܔ', is_letter = True, latin = 'j', ipa = 'dʒ')
-dalath = SyrChar('DALATH', 'ܕ', is_letter = True, latin = 'd', ipa = 'd')
-heh = SyrChar('HEH', 'ܗ', is_letter = True, is_matres = True, modifier_function=ModifierMatres, latin = 'h', ipa = 'h')
-waw = SyrChar('WAW', 'ܘ', is_letter = True, latin = 'w', ipa = 'w')
-zain = SyrChar('ZAIN', 'ܙ', is_letter = True, latin = 'z', ipa = 'z')
-kheth = SyrChar('KHETH', 'ܚ', is_letter = True, latin = 'kh', ipa = 'x')
-theth = SyrChar('THETH', 'ܛ', is_letter = True, latin = 'ṭ', ipa = 'tˤ')
-yodh = SyrChar('YODH', 'ܝ', is_letter = True, is_matres = True, modifier_function=ModifierMatres, latin = 'y', ipa = 'j')
-kap = SyrChar('KAP', 'ܟ', is_letter = True, latin = 'k', ipa = 'k')
-lammad = SyrChar('LAMMAD', 'ܠ', is_letter = True, latin = 'l', ipa = 'l')
-meem = SyrChar('MEEM', 'ܡ', is_letter = True, latin = 'm', ipa = 'm')
-nun = SyrChar('NUN', 'ܢ', is_letter = True, latin = 'n', ipa = 'n')
-simkat = SyrChar('SIMKAT', 'ܣ', is_letter = True, latin = 's', ipa = 's')
-simkat_final = SyrChar('SIMKAT_FINAL', 'ܤ', is_letter = True, latin = 's', ipa = 's')
-ain = SyrChar('AIN', 'ܥ', is_letter = True, latin = 'ʿ', ipa = 'ʕ')
-peh = SyrChar('PEH', 'ܦ', is_letter = True, latin = 'p', ipa = 'p')
-sadeh = SyrChar('PEH', 'ܨ', is_letter = True, latin = 'ṣ', ipa = 'sˤ')
-qop = SyrChar('QOP', 'ܩ', is_letter = True, latin = 'q', ipa = 'q')
-resh = SyrChar('RESH', 'ܪ', is_letter = True, latin = 'r', ipa = 'r')
-dotless_resh = SyrChar('DOTLESS_RESH', 'ܖ', is_letter = True, latin = '', ipa = '')
-shin = SyrChar('SHIN', 'ܫ', is_letter = True, latin = 'š', ipa = 'ʃ')
-taw = SyrChar('TAW', 'ܬ', is_letter = True, latin = 't', ipa = 't')
-
-zqappa = SyrChar('ZQAPPA', 'ܵ', is_vowel = True, latin = 'a', ipa = 'ɑ')
-ptakha = SyrChar('PTAKHA', 'ܲ', is_vowel = True, latin = 'a', ipa = 'a')
-zlama_kirya = SyrChar('ZLAMA_KIRYA', 'ܸ', is_vowel = True, latin = 'i', ipa = 'ɪ')
-zlama_yarikha = SyrChar('ZLAMA_YARIKHA', 'ܹ', is_vowel = True, latin = 'eh', ipa = 'e')
-pthaha_top = SyrChar('PTHAHA_TOP', 'ܰ', is_vowel = True, latin = 'a', ipa = 'a')
-pthaha_bottom = SyrChar('PTHAHA_BOTTOM', 'ܱ', is_vowel = True, latin = 'a', ipa = 'a')
-zqapha_top = SyrChar('ZQAPHA_TOP', 'ܳ', is_vowel = True, latin = 'o', ipa = 'o')
-zqapha_bottom = SyrChar('ZQAPHA_BOTTOM', 'ܴ', is_vowel = True, latin = 'o', ipa = 'o')
-rwasa_top = SyrChar('RWASA_TOP', 'ܶ', is_vowel = True, latin = 'e', ipa = 'e')
-hwasa_bottom = SyrChar('HWASA_BOTTOM', 'ܷ', is_vowel = True, latin = 'e', ipa = 'e')
-hwasa_top = SyrChar('HWASA_TOP', 'ܶ', is_vowel = True, latin = 'i', ipa = 'ɪ')
-esasa_bottom = SyrChar('ESASA_BOTTOM', 'ܷ', is_vowel = True, latin = 'u', ipa = 'u')
-esasa_top = SyrChar('ESASA_TOP', 'ܶ', is_vowel = True, latin = 'u', ipa = 'u')
-khwasa = SyrChar('KHWASA', 'ܼ', is_modifer = True, modifier_function = ModifierKhwasa)
-rwakha = SyrChar('RWAKHA', 'ܿ', is_modifer = True, modifier_function = ModifierRwakha)
-
-rukakha = SyrChar('RUKAKHA', '݂', is_modifer = True, modifier_function = ModifierRukakha)
-rukakha_semicircle  = SyrChar('RUKAKHA_SEMICIRCLE', '̮', is_modifer = True, modifier_function = ModifierRukakhaSemiCircle)
-majliana = SyrChar('MAJLIANA_BOTTOM', '̰', is_modifer = True, modifier_function = ModifierMajliana)
-majliana_top = SyrChar('MAJLIANA_TOP', '̃', is_modifer = True, modifier_function = ModifierMajliana)
-
-siyameh = SyrChar('SIYAMEH', '̈', is_siyameh = True, modifier_function = ModifierSiyameh)
-talqana = SyrChar('TALQANA', '݇', is_talqana = True, modifier_function = ModifierTalqana)
-talqana_bottom = SyrChar('TALQANA_BOTTOM', '݈', is_talqana = True, modifier_function = ModifierTalqana)
-
-# comma = SyrChar('COMMA', ',', is_punctuation = True)
-syrcomma = SyrChar('SYRCOMMA', '،', is_punctuation = True, punctuation_override=',')
-# semicolon = SyrChar('SEMICOMMA', ';', is_punctuation = True)
-syrsemicolon = SyrChar('SYRSEMICOMMA', '؛', is_punctuation = True, punctuation_override=';')
-# question = SyrChar('QUESTION', '?', is_punctuation = True)
-syrquestion = SyrChar('SYRQUESTION', '؟', is_punctuation = True, punctuation_override='?')
-# space = SyrChar('SPACE', ' ', is_punctuation = True)
-syrcolon = SyrChar('SYRCOLON', '܃', is_punctuation = True, punctuation_override='.')
-qanuna_top = SyrChar('QANUNA_TOP', '̇', is_qanuna = True, modifier_function=ModifierQanunaTop)
-qanuna_bottom = SyrChar('QANUNA_BOTTOM', '̣', is_qanuna = True, modifier_function=ModifierQanunaBottom)
-
-EastSyrChars = [alap, beth, gammal, gammal_garshuni, dalath, heh, waw, zain, kheth, theth, yodh, kap, lammad, meem, nun, simkat, simkat_final, ain, peh, sadeh, qop, resh, dotless_resh, shin, taw, zqappa, ptakha, zlama_kirya, zlama_yarikha, pthaha_top, pthaha_bottom, zqapha_top, zqapha_bottom, rwasa_top, hwasa_bottom, hwasa_top, esasa_bottom, esasa_top, khwasa, rwakha, rukakha, rukakha_semicircle, majliana, majliana_top, siyameh, talqana, talqana_bottom, syrcomma, syrsemicolon, syrquestion, syrcolon, qanuna_top, qanuna_bottom]
-# WestSyrChars = [alap_west, beth, gammal, gammal_garshuni, dalath, heh, waw, zain, kheth, theth, yodh, kap, lammad, meem, nun, simkat, simkat_final, ain, peh, sadeh, qop, resh, dotless_resh, shin, taw, zqappa, ptakha, zlama_kirya, zlama_yarikha, pthaha_top, pthaha_bottom, zqapha_top, zqapha_bottom, rwasa_top, hwasa_bottom, hwasa_top, esasa_bottom, esasa_top, khwasa, rwakha, rukakha, rukakha_semicircle, majliana, majliana_top, siyameh, talqana, talqana_bottom, comma, syrcomma, semicolon, syrsemicolon, question, syrquestion, qanuna_top, qanuna_bottom]
-SyrChars = EastSyrChars
+    ##
+    # Yields the word records (see word_records) of a text stream, a list of
+    # them per block (see SplitStreamBlocks), with spans counted from the
+    # start of the stream.
+    def word_records_stream(self, inputStream, chunk_size = StreamChunkSize):
+        offset = 0
+        for block in SplitStreamBlocks(inputStream, chunk_size):
+            yield self.word_records(block, offset)
+            offset += len(block)
+        self.flush()
 
-def PrintSyrCharArray(syrChars):
-    for char in syrChars:
-        print(f'{char.name}: {char.character}'.format())
+    ##
+    # Writes the words waiting in the store, if any, out to it.
+    def flush(self):
+        if self.store is not None:
+            self.store.Flush()
+
+    # renders a word as SyrWordToOutputs does, once it is vocalized
+    def _RenderUnvocalized(self, word, modes, dictionary, verbose, scheme):
+        return SyrWordToOutputs(self.skeletons.Vocalize(word), modes, dictionary, verbose, scheme)
+
+    # renders a word record as SyrWordToRecord does, once the word is vocalized
+    def _RenderRecord(self, word, modes, dictionary, verbose, scheme):
+        if self.skeletons is not None:
+            word = self.skeletons.Vocalize(word)
+        return SyrWordToRecord(word, modes, dictionary, verbose, scheme)
+
+    # takes a word record from the store, or renders it with render and stores
+    # it, returning the requested modes of it
+    def _RenderStored(self, word, modes, dictionary, verbose, scheme, render = None):
+        if not StoredModes.issuperset(modes):
+            # the records hold OutputModes only, so other modes of the scheme are not stored
+            return (render or self._renderWord)(word, modes, dictionary, verbose, scheme)
+        outputs = self.store.Get(word)
+        if outputs is None:
+            outputs = (render or self._RenderRecord)(word, WordRecordModes, dictionary, verbose, scheme)
+            self.store.Put(word, outputs)
+        if modes == WordRecordModes:
+            return outputs
+        return tuple([outputs[WordRecordModes.index(mode)] for mode in modes])
+
+    def _CollectWorkerBlock(self, result):
+        output, record = result
+        if record is not None:
+            self.stats.Record(record)
+        return output
 
-def TokenizeLettersWithModifiers(SyrChars):
-    tokens = []
+##
+# Reads a text stream chunk_size characters at a time and yields blocks that
+# end on the last newline of each chunk. A line longer than a chunk is split
+# on its last space instead, so no word is ever cut in two.
+def SplitStreamBlocks(inputStream, chunk_size):
+    pending = ''
+    while True:
+        chunk = inputStream.read(chunk_size)
+        if not chunk:
+            break
+        pending += chunk
+        cut = pending.rfind('\n') + 1
+        if cut == 0 and len(pending) >= chunk_size:
+            cut = pending.rfind(' ') + 1
+        if cut:
+            yield pending[:cut]
+            pending = pending[cut:]
+
+    if pending:
+        yield pending
+
+_WorkerTransliterator = None
+
+def _InitWorker(transliterator):
+    global _WorkerTransliterator
+    _WorkerTransliterator = transliterator
 
-    tok = []
-    for char in SyrChars:
-        if char.is_letter:
-            if len(tok) > 0:
-                tokens.append(SyrToken(tok))
-                tok = []
-        elif char.name == 'NON-SYR-CHAR':
-            if len(tok) > 0:
-                tokens.append(SyrToken(tok))
-                tok = []
-            
-            tokens.append(SyrToken([char]))
-            
+##
+# Runs in a worker: returns a block's output with its stats record, if any,
+# for the parent to total, since the worker's copy of the stats is its own.
+# New stored words are written out after every block, since workers are
+# ended without notice.
+def _TransliterateWorkerBlock(block):
+    if _WorkerTransliterator.stats is None:
+        result = _WorkerTransliterator.transliterate(block), None
+    else:
+        result = _WorkerTransliterator._TransliterateWithStats(block)
+    _WorkerTransliterator.flush()
+    return result
+
+# the fields of a word record, as made by Transliterator.word_records
+WordRecordFields = ('start', 'end', 'word', 'bdol', 'ipa', 'latin')
+
+##
+# Formats word records as JSON lines, one object of WordRecordFields per word.
+# Lines are formatted directly rather than through a dict per record, and
+# each distinct string is JSON encoded once, since words repeat.
+def WordRecordsToJSONLines(records):
+    encode = json.JSONEncoder(ensure_ascii=False).encode
+    encoded = {}
+
+    def Encode(value):
+        text = encoded.get(value)
+        if text is None:
+            text = encoded[value] = encode(value)
+        return text
+
+    return ''.join([f'{{"start": {start}, "end": {end}, "word": {Encode(word)}, "bdol": {"true" if bdol else "false"}, '
+                    f'"ipa": {Encode(ipa)}, "latin": {Encode(latin)}}}\n'
+                    for start, end, word, bdol, ipa, latin in records])
+
+WordColumnsMagic = b'SYRCOLS1'
+# magic, record count, then the file offset of the start, end, bdol, word, ipa and latin columns
+WordColumnsHeader = struct.Struct('<8sQ6Q')
+WordColumnsField = struct.Struct('<Q')
+# the columns of WordColumnsHeader holding strings
+WordColumnsStrings = ('word', 'ipa', 'latin')
+
+##
+# Writes blocks of word records (see Transliterator.word_records_stream) to a
+# binary file in the columnar format read by WordColumns. Records are packed
+# into their columns block by block, so only the packed columns are held
+# until the end, when the record count and column sizes are known.
+def WriteWordColumns(blocks, outputFile):
+    starts, ends, bdols = array('Q'), array('Q'), bytearray()
+    strings = [(array('Q', [0]), bytearray()) for field in WordColumnsStrings]
+    for records in blocks:
+        if not records:
             continue
+        blockStarts, blockEnds, words, blockBdols, ipas, latins = zip(*records)
+        starts.extend(blockStarts)
+        ends.extend(blockEnds)
+        bdols.extend(blockBdols)
+        for (offsets, data), column in zip(strings, (words, ipas, latins)):
+            encoded = [value.encode('utf-8') for value in column]
+            offsets.extend(islice(accumulate(map(len, encoded), initial=offsets[-1]), 1, None))
+            data += b''.join(encoded)
+
+    if sys.byteorder != 'little':
+        for column in [starts, ends] + [offsets for offsets, _ in strings]:
+            column.byteswap()
+
+    sections = [starts.tobytes(), ends.tobytes(), bytes(bdols)]
+    sections += [offsets.tobytes() + data for offsets, data in strings]
+    positions = []
+    position = WordColumnsHeader.size
+    for section in sections:
+        positions.append(position)
+        # every column starts 8-byte aligned, so it can be viewed as an array in place
+        position += -(-len(section) // 8) * 8
+
+    outputFile.write(WordColumnsHeader.pack(WordColumnsMagic, len(starts), *positions))
+    for section in sections:
+        outputFile.write(section)
+        outputFile.write(bytes(-len(section) % 8))
+
+class WordColumns:
+    ##
+    # Word records memory-mapped from a file written by WriteWordColumns, for
+    # loading without parsing each record. The numeric columns are exposed
+    # as memoryviews of the file, so they can be handed to array libraries
+    # as they are.
+    #
+    # Layout, all integers little-endian uint64 and every column 8-byte aligned:
+    #   header: WordColumnsHeader
+    #   start:  record count offsets of where each word starts in the source text, in characters
+    #   end:    record count offsets of where each word ends
+    #   bdol:   record count bytes, 1 for a word read as a BDOL
+    #   word, ipa, latin: record count + 1 offsets, then the UTF-8 strings
+    #
+    # path: str - the path of the columnar file
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as columnsFile:
+            self._map = mmap.mmap(columnsFile.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, self._count, start, end, bdol, *strings = WordColumnsHeader.unpack_from(self._map)
+        if magic != WordColumnsMagic:
+            self._map.close()
+            raise ValueError(f'not a word columns file: {path}')
+        self._view = memoryview(self._map)
+        self.start = self._Offsets(start, self._count)
+        self.end = self._Offsets(end, self._count)
+        self.bdol = self._view[bdol:bdol + self._count]
+        self._strings = [(self._Offsets(position, self._count + 1),
+                          position + (self._count + 1) * WordColumnsField.size) for position in strings]
+
+    def __len__(self):
+        return self._count
+
+    def __getitem__(self, index):
+        if not -self._count <= index < self._count:
+            raise IndexError('word record index out of range')
+        index %= self._count
+        word, ipa, latin = [self._map[data + offsets[index]:data + offsets[index + 1]].decode('utf-8')
+                            for offsets, data in self._strings]
+        return self.start[index], self.end[index], word, bool(self.bdol[index]), ipa, latin
+
+    def __iter__(self):
+        for index in range(self._count):
+            yield self[index]
 
-        tok.append(char)
-    
-    if len(tok) > 0:
-        tokens.append(SyrToken(tok))
+    ##
+    # The values of one string column ('word', 'ipa' or 'latin'), in record order.
+    def Strings(self, field):
+        offsets, data = self._strings[WordColumnsStrings.index(field)]
+        text = self._map[data:data + offsets[self._count]]
+        return [text[offsets[index]:offsets[index + 1]].decode('utf-8') for index in range(self._count)]
+
+    def close(self):
+        for view in [self.start, self.end, self.bdol, self._view] + [offsets for offsets, _ in self._strings]:
+            view.release()
+        self._map.close()
+
+    def _Offsets(self, position, count):
+        offsets = self._view[position:position + count * WordColumnsField.size]
+        if sys.byteorder != 'little':
+            swapped = array('Q', offsets)
+            swapped.byteswap()
+            return memoryview(swapped)
+        return offsets.cast('Q')
+
+# the lines of a text, each with its newline; a word never spans two
+DocumentLines = re.compile(r'[^\n]*\n|[^\n]+')
+
+class Document:
+    ##
+    # A text kept transliterated across edits, for editors that transliterate
+    # as the user types. Rendering context never crosses a word boundary, so
+    # an edit only re-transliterates the words it touches; the rest of the
+    # output is kept.
+    #
+    # The text is held line by line, each line split into words and the
+    # whitespace between them as SyrStrToOutputs splits it, along with the
+    # output of each piece. Offsets between the text and its output map
+    # exactly at word boundaries and in whitespace; an offset inside a word
+    # maps to the start of the word's counterpart.
+    #
+    # text:           str - the initial text
+    # transliterator: Transliterator - transliterates the words, by default an IPA one
+    def __init__(self, text = '', transliterator = None):
+        self.transliterator = transliterator or Transliterator()
+        self._lines = []
+        self._pieces = []
+        self._outputPieces = []
+        self._outputLines = []
+        self._InsertLines(0, DocumentLines.findall(text), {})
+
+    @property
+    def text(self):
+        if self._text is None:
+            self._text = ''.join(self._lines)
+        return self._text
+
+    @property
+    def output(self):
+        if self._output is None:
+            self._output = ''.join(self._outputLines)
+        return self._output
 
-    return tokens
+    ##
+    # Replaces text[start:end] with replacement. Returns the matching edit of
+    # the output as (output start, output end, output replacement): applying
+    # it to the output before this edit gives the output after it.
+    def Edit(self, start, end, replacement):
+        sourceStarts, outputStarts = self._Starts()
+        if not 0 <= start <= end <= sourceStarts[-1]:
+            raise ValueError(f'edit range {start}:{end} is outside the text of length {sourceStarts[-1]}')
+
+        # the lines holding the edit, and the one after if the edit leaves the last unterminated
+        first = max(min(bisect_right(sourceStarts, start) - 1, len(self._lines) - 1), 0)
+        last = min(bisect_right(sourceStarts, end) - 1, len(self._lines) - 1)
+        offset = sourceStarts[first]
+        region = ''.join(self._lines[first:last + 1])
+        region = region[:start - offset] + replacement + region[end - offset:]
+        if not region.endswith('\n') and last + 1 < len(self._lines):
+            last += 1
+            region += self._lines[last]
+
+        # words kept from the replaced lines are not transliterated again
+        known = {}
+        for pieces, outputPieces in zip(self._pieces[first:last + 1], self._outputPieces[first:last + 1]):
+            known.update(zip(pieces[0::2], outputPieces[0::2]))
+        oldOutput = ''.join(self._outputLines[first:last + 1])
+        del self._lines[first:last + 1], self._pieces[first:last + 1]
+        del self._outputPieces[first:last + 1], self._outputLines[first:last + 1]
+        newOutput = ''.join(self._InsertLines(first, DocumentLines.findall(region), known))
+
+        # trimmed to what actually changed
+        head = len(os.path.commonprefix([oldOutput, newOutput]))
+        tail = len(os.path.commonprefix([oldOutput[head:][::-1], newOutput[head:][::-1]]))
+        outputStart = outputStarts[first] + head
+        return outputStart, outputStarts[first] + len(oldOutput) - tail, newOutput[head:len(newOutput) - tail]
+
+    ##
+    # The output offset of a text offset.
+    def SourceToOutput(self, offset):
+        return self._MapOffset(offset, *self._Starts(), self._pieces, self._outputPieces)
+
+    ##
+    # The text offset of an output offset.
+    def OutputToSource(self, offset):
+        sourceStarts, outputStarts = self._Starts()
+        return self._MapOffset(offset, outputStarts, sourceStarts, self._outputPieces, self._pieces)
+
+    ##
+    # The offset map of the whole text: a (text start, text end, output start,
+    # output end) span for every word.
+    def WordSpans(self):
+        sourceStarts, outputStarts = self._Starts()
+        for line, (pieces, outputPieces) in enumerate(zip(self._pieces, self._outputPieces)):
+            source, output = sourceStarts[line], outputStarts[line]
+            for i, (piece, outputPiece) in enumerate(zip(pieces, outputPieces)):
+                if i % 2 == 0 and piece:
+                    yield source, source + len(piece), output, output + len(outputPiece)
+                source += len(piece)
+                output += len(outputPiece)
+
+    # splits and transliterates lines into the document at a line index,
+    # taking the output of words in known from there; returns their outputs
+    def _InsertLines(self, index, lines, known):
+        split = WhitespaceRuns.split
+        transliterate = self.transliterator.transliterate
+        allPieces, allOutputPieces, outputLines = [], [], []
+        for line in lines:
+            pieces = split(line)
+            outputPieces = pieces[:]
+            outputPieces[0::2] = [known[word] if word in known else transliterate(word) for word in pieces[0::2]]
+            allPieces.append(pieces)
+            allOutputPieces.append(outputPieces)
+            outputLines.append(''.join(outputPieces))
+
+        self._lines[index:index] = lines
+        self._pieces[index:index] = allPieces
+        self._outputPieces[index:index] = allOutputPieces
+        self._outputLines[index:index] = outputLines
+        self._text = self._output = self._starts = None
+        return outputLines
+
+    # the text and output offsets of every line, and of the end
+    def _Starts(self):
+        if self._starts is None:
+            self._starts = (list(accumulate(map(len, self._lines), initial=0)),
+                            list(accumulate(map(len, self._outputLines), initial=0)))
+        return self._starts
+
+    def _MapOffset(self, offset, fromStarts, toStarts, fromPieces, toPieces):
+        if not 0 <= offset <= fromStarts[-1]:
+            raise ValueError(f'offset {offset} is outside the range 0:{fromStarts[-1]}')
+        line = bisect_right(fromStarts, offset) - 1
+        if line == len(fromPieces):
+            return toStarts[-1]
+
+        position, mapped = fromStarts[line], toStarts[line]
+        for i, (piece, toPiece) in enumerate(zip(fromPieces[line], toPieces[line])):
+            if offset < position + len(piece):
+                # whitespace is copied verbatim, words map to their start
+                return mapped + (offset - position if i % 2 else 0)
+            position += len(piece)
+            mapped += len(toPiece)
+        return mapped
+
+# threads reading and writing files in bulk mode, and files read ahead of the transliterator
+BulkIoThreads = 8
+BulkReadAhead = 64
+# the manifest bulk mode keeps in its output directory, one JSON line per file written
+BulkManifestName = '.syr2ipa-manifest.jsonl'
 
-def StrToSyrChars(word):
-    thisChar = None
-    syrChars = []
-    for char in word:
-        for syrChar in SyrChars:
-            if char == syrChar.character:
-                thisChar = syrChar
-        if thisChar is None:
-            # not a known syr char
-            thisChar = SyrChar('NON-SYR-CHAR', char)
-        syrChars.append(thisChar)
-        thisChar = None
-
-    return syrChars
-
-def SyrStrStrToIPA(syrStr, dictionary=None):
-    spaceSplit = syrStr.split(' ')
-    ipa = ''
-    latin = ''
-    for word in spaceSplit:
-        if dictionary:
-            is_bdol, _ = IsBDOL(CleanUpWord(word), dictionary)
+##
+# Yields the (path, relative path) of every file of bulk inputs: directories,
+# walked recursively, and glob patterns, with ** matching any number of
+# directories. Paths are relative to the directory or to the directories of
+# the pattern before its first wildcard. Anything under skipDir is left out.
+def BulkInputs(inputs, skipDir = None):
+    # imported here so that other modes do not pay for loading it
+    import glob
+    skipDir = os.path.realpath(skipDir) if skipDir else None
+
+    def Skipped(path):
+        return skipDir is not None and (os.path.realpath(path) + os.sep).startswith(skipDir + os.sep)
+
+    for pattern in inputs:
+        if os.path.isdir(pattern):
+            for directory, subdirectories, files in os.walk(pattern):
+                subdirectories[:] = sorted(d for d in subdirectories if not Skipped(os.path.join(directory, d)))
+                for name in sorted(files):
+                    path = os.path.join(directory, name)
+                    yield path, os.path.relpath(path, pattern)
+            continue
+
+        parts = pattern.split(os.sep)
+        base = os.sep.join(parts[:next(i for i, part in enumerate(parts + ['*']) if glob.has_magic(part))]) or os.curdir
+        for path in sorted(glob.glob(pattern, recursive=True)):
+            if os.path.isfile(path) and not Skipped(path):
+                yield path, os.path.relpath(path, base)
+
+##
+# Transliterates many files into an output directory in one process, keeping
+# their relative paths; a file whose relative path a file of an earlier input
+# already has fails, rather than overwrite its output. Threads read files ahead of the transliterator and
+# write its outputs behind it, so it is never waiting on the disk.
+#
+# Every file written is recorded in a manifest in the output directory with
+# the hash of its content and the version of the transliteration. Files whose
+# content and version match the manifest, and whose output is still there,
+# are skipped, so a re-run only does what changed and an interrupted run
+# resumes where it stopped.
+#
+# transliterator: Transliterator - transliterates the files
+# inputs:         list - directories and glob patterns (see BulkInputs)
+# outputDir:      str - the directory outputs are written to, created if needed
+# version:        str - identifies the transliteration, as a mode and WordStoreKey
+# Returns the counts of files 'written', 'skipped' and 'failed'.
+def BulkTransliterate(transliterator, inputs, outputDir, version):
+    # imported here so that other modes do not pay for loading it
+    from concurrent.futures import ThreadPoolExecutor
+
+    os.makedirs(outputDir, exist_ok=True)
+    manifestPath = os.path.join(outputDir, BulkManifestName)
+    manifest = {}
+    try:
+        with open(manifestPath, 'r', encoding='utf-8') as manifestFile:
+            for line in manifestFile:
+                try:
+                    entry = json.loads(line)
+                    manifest[entry['path']] = entry
+                except (ValueError, KeyError, TypeError):
+                    continue
+    except FileNotFoundError:
+        pass
+
+    def Read(path):
+        with open(path, 'rb') as inputFile:
+            data = inputFile.read()
+        return data, hashlib.sha256(data).hexdigest()
+
+    def Write(outputPath, output):
+        os.makedirs(os.path.dirname(outputPath), exist_ok=True)
+        partialPath = f'{outputPath}.{os.getpid()}.partial'
+        with open(partialPath, 'w', encoding='utf-8') as outputFile:
+            outputFile.write(output)
+        os.replace(partialPath, outputPath)
+
+    counts = {'written': 0, 'skipped': 0, 'failed': 0}
+    with ThreadPoolExecutor(BulkIoThreads) as pool, open(manifestPath, 'a', encoding='utf-8') as manifestFile:
+        reads = deque()
+        writes = deque()
+
+        # records a write in the manifest once it is done, or waits for it
+        def Recorded(write, wait):
+            relativePath, sourceHash, future = write
+            if not wait and not future.done():
+                return False
+            error = future.exception()
+            if error is not None:
+                print(f'Error writing {relativePath}: {error}', file=sys.stderr)
+                counts['failed'] += 1
+                return True
+            entry = {'path': relativePath, 'hash': sourceHash, 'version': version}
+            manifestFile.write(json.dumps(entry, ensure_ascii=False) + '\n')
+            manifestFile.flush()
+            manifest[relativePath] = entry
+            counts['written'] += 1
+            return True
+
+        def Transliterate(relativePath, future):
+            try:
+                data, sourceHash = future.result()
+                text = data.decode('utf-8')
+            except (OSError, UnicodeDecodeError) as error:
+                print(f'Error reading {relativePath}: {error}', file=sys.stderr)
+                counts['failed'] += 1
+                return
+            outputPath = os.path.join(outputDir, relativePath)
+            entry = manifest.get(relativePath)
+            if (entry is not None and entry.get('hash') == sourceHash and entry.get('version') == version
+                    and os.path.exists(outputPath)):
+                counts['skipped'] += 1
+                return
+            output = transliterator.transliterate(text)
+            writes.append((relativePath, sourceHash, pool.submit(Write, outputPath, output)))
+            # record the writes that are done, in order, without waiting on the rest
+            while writes and Recorded(writes[0], False):
+                writes.popleft()
+
+        # the file behind each relative path, as files of two inputs may share one
+        sources = {}
+        for path, relativePath in BulkInputs(inputs, outputDir):
+            source = os.path.realpath(path)
+            if relativePath in sources:
+                # a file met again through another input is done once
+                if sources[relativePath] != source:
+                    print(f'Error reading {path}: {sources[relativePath]} is already written to {relativePath}',
+                          file=sys.stderr)
+                    counts['failed'] += 1
+                continue
+            sources[relativePath] = source
+            reads.append((relativePath, pool.submit(Read, path)))
+            if len(reads) >= BulkReadAhead:
+                Transliterate(*reads.popleft())
+        while reads:
+            Transliterate(*reads.popleft())
+        while writes:
+            Recorded(writes.popleft(), True)
+
+    # the manifest is rewritten with one line per file, the last of each
+    partialPath = f'{manifestPath}.{os.getpid()}.partial'
+    with open(partialPath, 'w', encoding='utf-8') as manifestFile:
+        for entry in manifest.values():
+            manifestFile.write(json.dumps(entry, ensure_ascii=False) + '\n')
+    os.replace(partialPath, manifestPath)
+    transliterator.flush()
+    return counts
+
+# the address --serve http listens on by default
+ServeHost = '127.0.0.1'
+ServePort = 8421
+
+# JSON escapes such as "\ud800" parse to lone surrogates, which have no UTF-8
+FindSurrogate = re.compile('[\ud800-\udfff]').search
+
+class TransliterationService:
+    ##
+    # Answers transliteration requests from warm transliterators, one per
+    # output mode, sharing the dictionary, scheme and stats. A request is a
+    # JSON object with either a "text" or a batch of "texts", and optionally
+    # the output "mode" and an "id" that is echoed back. The response holds
+    # the "output" or "outputs", or an "error". With a reverse index, a
+    # "search" for a latin or IPA word is answered with its Syriac "matches".
+    #
+    # Requests may come from several threads; the transliterators and their
+    # word caches are used by one at a time.
+    #
+    # mode:       str - the output mode of requests that do not name one
+    # dictionary: dict - a corpus dictionary used for BDOL detection
+    # cache_size: int - the number of distinct words each mode memoizes
+    # scheme:     Scheme - the character scheme
+    # stats:      TransliterationStats - gather counters and stage timers into this
+    # index:      ReverseIndex - the index searched by "search" requests
+    # unvocalized: SkeletonIndex - vocalize unpointed words from this
+    # store:      WordStore - keep words across runs in this
+    def __init__(self, mode = 'ipa', dictionary = None, cache_size = 65536, scheme = None, stats = None, index = None,
+                 unvocalized = None, store = None):
+        self.mode = mode
+        self.stats = stats
+        self.index = index
+        self.transliterators = {outputMode: Transliterator(outputMode, dictionary, False, cache_size, scheme, stats,
+                                                           unvocalized, store)
+                                for outputMode in (scheme or DefaultScheme).modes}
+        self._lock = threading.Lock()
+
+    def Handle(self, request):
+        if not isinstance(request, dict):
+            return {'error': 'a request must be a JSON object'}
+
+        response = {}
+        if 'id' in request:
+            response['id'] = request['id']
+
+        mode = request.get('mode', self.mode)
+        transliterator = self.transliterators.get(mode) if isinstance(mode, str) else None
+        if 'search' in request:
+            if self.index is None:
+                response['error'] = 'no reverse index is loaded, start with --index'
+            elif not isinstance(request['search'], str):
+                response['error'] = 'a "search" must be a string'
+            elif FindSurrogate(request['search']):
+                response['error'] = 'a "search" must not hold lone surrogates'
+            else:
+                response['matches'] = self.index.Lookup(request['search'])
+        elif not isinstance(mode, str):
+            response['error'] = 'a "mode" must be a string'
+        elif transliterator is None:
+            response['error'] = f'unknown output mode: {mode}'
+        elif isinstance(request.get('texts'), list) and all(isinstance(text, str) for text in request['texts']):
+            if any(map(FindSurrogate, request['texts'])):
+                response['error'] = '"texts" must not hold lone surrogates'
+                return response
+            with self._lock:
+                response['outputs'] = list(transliterator.transliterate_many(request['texts']))
+        elif isinstance(request.get('text'), str):
+            if FindSurrogate(request['text']):
+                response['error'] = 'a "text" must not hold lone surrogates'
+                return response
+            with self._lock:
+                response['output'] = transliterator.transliterate(request['text'])
         else:
-            is_bdol = False
+            response['error'] = 'a request needs a "text" string or a "texts" list of strings'
+        return response
 
-        if is_bdol:
-            word = word[0] + "'" + word[1:]
+    def Stats(self):
+        stats = {mode: transliterator.cache.Stats() for mode, transliterator in self.transliterators.items()
+                 if transliterator.cache is not None}
+        if self.stats is not None:
+            stats['transliteration'] = self.stats.Stats()
+        return stats
 
-        syrCharArray = StrToSyrChars(word)
-        if args.verbose:
-            PrintSyrCharArray(syrCharArray)
-        tokens = TokenizeLettersWithModifiers(syrCharArray)
-        i,l = SyrCharTokensToIPA(tokens)
-        ipa += i + ' '
-        latin += l + ' '
+##
+# Encodes a response as JSON, leaving non-ASCII text unescaped unless the
+# response holds lone surrogates (in an echoed "id", say), which are escaped
+# instead so that the response can still be written as UTF-8.
+def EncodeResponse(response):
+    encoded = json.dumps(response, ensure_ascii=False)
+    if FindSurrogate(encoded):
+        encoded = json.dumps(response)
+    return encoded
 
-    return ipa, latin
+##
+# Serves requests as JSON lines: one request object per input line, one
+# response object per output line, flushed as soon as it is written.
+def ServeStdio(service, inputStream, outputStream):
+    for line in inputStream:
+        if not line.strip():
+            continue
+        try:
+            request = json.loads(line)
+        except ValueError:
+            encoded = EncodeResponse({'error': 'invalid JSON'})
+        else:
+            try:
+                encoded = EncodeResponse(service.Handle(request))
+            except Exception as error:
+                # one bad request must not take the server down
+                encoded = EncodeResponse({'error': f'could not handle the request: {error}'})
+        outputStream.write(encoded + '\n')
+        outputStream.flush()
+
+##
+# Serves requests over HTTP/1.1 with keep-alive, a thread per connection:
+#   POST /       a request object, answered with its response object
+#   GET /stats   word cache and transliteration stats
+#   GET /health  {"status": "ok"}
+def ServeHttp(service, host = ServeHost, port = ServePort, verbose = False):
+    # imported here so that other modes do not pay for loading them
+    import http.server
+
+    class RequestHandler(http.server.BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+        # headers and body go out in separate writes; without TCP_NODELAY the
+        # body waits for the client's delayed ACK, about 40ms per response
+        disable_nagle_algorithm = True
+
+        def do_POST(self):
+            try:
+                request = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))))
+            except ValueError:
+                self.Respond(400, {'error': 'invalid JSON'})
+                return
+            try:
+                response = service.Handle(request)
+            except Exception as error:
+                self.Respond(500, {'error': f'could not handle the request: {error}'})
+                return
+            self.Respond(400 if 'error' in response else 200, response)
+
+        def do_GET(self):
+            if self.path == '/stats':
+                self.Respond(200, service.Stats())
+            elif self.path == '/health':
+                self.Respond(200, {'status': 'ok'})
+            else:
+                self.Respond(404, {'error': f'no such path: {self.path}'})
+
+        def Respond(self, status, response):
+            body = EncodeResponse(response).encode('utf-8')
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json; charset=utf-8')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            if verbose:
+                super().log_message(format, *args)
+
+    server = http.server.ThreadingHTTPServer((host, port), RequestHandler)
+    server.daemon_threads = True
+    print(f'syr2ipa serving on http://{host}:{server.server_address[1]}', file=sys.stderr)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+# newline: as for open(); '' keeps line endings as they are, so offsets into the text match the file
+def OpenInput(path, newline = None):
+    if path is None or path == '-':
+        return open(sys.stdin.fileno(), 'r', encoding='utf-8', newline=newline, closefd=False)
+    return open(path, 'r', encoding='utf-8', newline=newline)
+
+def OpenOutput(path):
+    if path is None or path == '-':
+        return open(sys.stdout.fileno(), 'w', encoding='utf-8', buffering=StreamBufferSize, closefd=False)
+    return open(path, 'w', encoding='utf-8', buffering=StreamBufferSize)
+
+def OpenBinaryOutput(path):
+    if path is None or path == '-':
+        return open(sys.stdout.fileno(), 'wb', buffering=StreamBufferSize, closefd=False)
+    return open(path, 'wb', buffering=StreamBufferSize)
+
+def BuildArgumentParser():
+    parser = argparse.ArgumentParser(description='syr2ipa - Syriac to IPA transcriber')
+    parser.add_argument('-t', '--text',
+                        help='Pass input text via this argument in stdin')
+    parser.add_argument('-f', '--file',
+                        help='Read Syriac input from a text file, or - for stdin')
+    parser.add_argument('-o', '--output',
+                        help='Specify which file to write out the transcription to, or - for stdout. Default is stdout. '
+                             'With --bulk, the directory to write the transcriptions to.')
+    parser.add_argument('-s', '--stream', action='store_true',
+                        help='Stream the input file (default stdin) through in large chunks with buffered output')
+    parser.add_argument('-j', '--jobs', type=int, default=1,
+                        help='Transliterate a stream with N worker processes (0 for one per core); implies --stream')
+    parser.add_argument('--bulk', action='append', metavar='DIR_OR_GLOB',
+                        help='Transliterate every file of a directory, or matching a glob, into the -o directory, '
+                             'skipping files unchanged since the last run. May be repeated.')
+    parser.add_argument('--serve', choices=['stdio', 'http'],
+                        help='Keep running and answer JSON requests, as JSON lines on stdin/stdout or over local HTTP')
+    parser.add_argument('--listen', default=f'{ServeHost}:{ServePort}', metavar='HOST:PORT',
+                        help=f'Address for --serve http. Default is {ServeHost}:{ServePort}.')
+    parser.add_argument('--format', choices=['text', 'jsonl', 'columnar'], default='text',
+                        help='Write the transliteration as text, or one record per word with its source span, '
+                             'dictionary key, BDOL flag and both IPA and latin forms: as JSON lines, or as a '
+                             'columnar binary file')
+    parser.add_argument('-l', '--latin', action='store_true',
+                        help='Transcibe into latin phonetics in place of IPA')
+    parser.add_argument('-d', '--dictionary',
+                        help='Load a JSON or compiled word dictionary to improve accuracy')
+    parser.add_argument('-u', '--unvocalized', action='store_true',
+                        help='Vocalize unpointed words with their most frequent form in the -d dictionary')
+    parser.add_argument('--compile-dictionary', metavar='OUTPUT',
+                        help='Compile the JSON dictionary given with -d into an indexed file for fast loading, then exit')
+    parser.add_argument('--index', metavar='PATH',
+                        help='A reverse index file for --build-index and --search')
+    parser.add_argument('--build-index', action='store_true',
+                        help='Add the words of the -d dictionary and of the -t/-f text to the --index file, creating it if needed, then exit')
+    parser.add_argument('--search', metavar='QUERY',
+                        help='Print the Syriac words of the --index file matching a latin or IPA word, one per line, then exit')
+    parser.add_argument('-c', '--scheme', default='east',
+                        help='Character scheme to use: the name of one in schemes/, the path of a JSON scheme file, '
+                             'or auto to pick East or West Syriac for each word')
+    parser.add_argument('-v', '--verbose', action='store_true',
+                        help='Enable verbose logging output')
+    parser.add_argument('--stats', action='store_true',
+                        help='Print word, token, cache and per-stage timing statistics to stderr on exit')
+    parser.add_argument('--cache-size', type=int, default=65536,
+                        help='Number of distinct words to memoize (0 disables the word cache)')
+    parser.add_argument('--persistent-cache', metavar='PATH',
+                        help='Keep transliterated words in this SQLite file, shared across runs and processes')
+    parser.add_argument('--persistent-cache-size', type=int, default=1 << 20,
+                        help='Number of words kept in the --persistent-cache file before the oldest are evicted')
+    return parser
+
+def main(argv=None):
+    args = BuildArgumentParser().parse_args(argv)
+
+    if args.jobs < 0:
+        print('Error: --jobs must be 0 or more')
+        exit(1)
 
-if __name__ == "__main__":
     inputFile = None
     outputFile = None
     dictionary = None
 
-    if args.latin:
-        latinOutput = True
+    if args.compile_dictionary:
+        if not args.dictionary:
+            print('Error: --compile-dictionary needs a JSON dictionary given with -d')
+            exit(1)
+        try:
+            CompileDictionary(args.dictionary, args.compile_dictionary)
+        except:
+            print(f'Error: could not compile dictionary file {args.dictionary}'.format())
+            exit(1)
+        return
 
     if args.dictionary:
         try:
-            inputDict = open(args.dictionary, 'r')
-            dictionary = json.load(inputDict)
-            inputDict.close()
+            dictionary = LoadDictionary(args.dictionary)
         except:
             print(f'Error: could not open dictionary file {args.dictionary}'.format())
             exit(1)
 
-    if args.output:
+    try:
+        scheme = GetScheme(args.scheme)
+    except:
+        print(f'Error: could not load character scheme {args.scheme}'.format())
+        exit(1)
+
+    if (args.build_index or args.search is not None) and not args.index:
+        print('Error: --build-index and --search need a reverse index file given with --index')
+        exit(1)
+
+    index = None
+    if args.index:
+        try:
+            index = LoadReverseIndex(args.index, scheme, dictionary)
+        except FileNotFoundError:
+            if not args.build_index:
+                print(f'Error: could not open reverse index file {args.index}'.format())
+                exit(1)
+            index = ReverseIndex(scheme, dictionary)
+        except:
+            print(f'Error: could not open reverse index file {args.index}'.format())
+            exit(1)
+
+    if args.build_index or args.search is not None:
+        if args.search is not None:
+            for word in index.Lookup(args.search):
+                print(word)
+            return
+
+        added = index.Add(dictionary or ())
+        if args.text is not None:
+            added += index.AddText(args.text)
+        if args.file:
+            try:
+                inputFile = OpenInput(args.file)
+            except:
+                print(f'Error opening input file: {args.file}'.format())
+                exit(1)
+            for line in inputFile:
+                added += index.AddText(line)
+            inputFile.close()
+        try:
+            index.Save(args.index)
+        except OSError:
+            print(f'Error: could not write reverse index file {args.index}'.format())
+            exit(1)
+        print(f'Indexed {added:,} new words, {len(index):,} in total', file=sys.stderr)
+        return
+
+    skeletons = None
+    if args.unvocalized:
+        if not dictionary:
+            print('Error: --unvocalized needs a dictionary given with -d')
+            exit(1)
+        skeletons = LoadSkeletonIndex(dictionary)
+
+    stats = None
+    if args.stats:
+        stats = TransliterationStats()
+        atexit.register(lambda: print(stats.Summary(), file=sys.stderr))
+
+    store = None
+    if args.persistent_cache:
+        try:
+            store = WordStore(args.persistent_cache, WordStoreKey(scheme, args.dictionary, skeletons), args.persistent_cache_size)
+        except:
+            print(f'Error: could not open persistent cache {args.persistent_cache}'.format())
+            exit(1)
+        atexit.register(store.Close)
+
+    transliterator = Transliterator('latin' if args.latin else 'ipa', dictionary, args.verbose, args.cache_size, scheme, stats,
+                                    skeletons, store)
+
+    if args.format != 'text' and (args.serve or args.bulk or args.jobs != 1):
+        print('Error: --format jsonl and columnar are not supported with --serve, --bulk or --jobs')
+        exit(1)
+
+    if args.serve:
+        service = TransliterationService(transliterator.mode, dictionary, args.cache_size, scheme, stats, index, skeletons,
+                                         store)
+        if args.serve == 'stdio':
+            ServeStdio(service, sys.stdin, sys.stdout)
+            return
+
+        host, _, port = args.listen.rpartition(':')
+        try:
+            ServeHttp(service, host or ServeHost, int(port), args.verbose)
+        except (OSError, ValueError):
+            print(f'Error: could not listen on {args.listen}'.format())
+            exit(1)
+        return
+
+    if args.bulk:
+        if not args.output or args.output == '-':
+            print('Error: --bulk needs an output directory given with -o')
+            exit(1)
+        version = f'{transliterator.mode}-{WordStoreKey(scheme, args.dictionary, skeletons)}'
+        try:
+            counts = BulkTransliterate(transliterator, args.bulk, args.output, version)
+        except OSError as error:
+            print(f'Error: could not write to output directory {args.output}: {error}'.format())
+            exit(1)
+        print(f'{counts["written"]:,} files written, {counts["skipped"]:,} unchanged, {counts["failed"]:,} failed',
+              file=sys.stderr)
+        if counts['failed']:
+            exit(1)
+        return
+
+    if args.format != 'text':
+        if args.text is not None:
+            blocks = [transliterator.word_records(args.text)]
+        else:
+            try:
+                inputFile = OpenInput(args.file, newline='')
+            except:
+                print(f'Error opening input file: {args.file}'.format())
+                exit(1)
+            blocks = transliterator.word_records_stream(inputFile)
+        try:
+            outputFile = OpenOutput(args.output) if args.format == 'jsonl' else OpenBinaryOutput(args.output)
+        except:
+            print(f'Error opening output file: {args.output}'.format())
+            exit(1)
+
+        if args.format == 'jsonl':
+            for records in blocks:
+                outputFile.write(WordRecordsToJSONLines(records))
+        else:
+            WriteWordColumns(blocks, outputFile)
+
+        outputFile.close()
+        if inputFile:
+            inputFile.close()
+        return
+
+    if args.stream or args.jobs != 1:
+        if args.text is not None:
+            inputFile = io.StringIO(args.text)
+        else:
+            try:
+                inputFile = OpenInput(args.file)
+            except:
+                print(f'Error opening input file: {args.file}'.format())
+                exit(1)
+        try:
+            outputFile = OpenOutput(args.output)
+        except:
+            print(f'Error opening output file: {args.output}'.format())
+            exit(1)
+
+        for outputText in transliterator.transliterate_stream(inputFile, jobs=args.jobs):
+            outputFile.write(outputText)
+        # as print() ends the output of -t without --stream
+        if args.text is not None and (args.output is None or args.output == '-'):
+            outputFile.write('\n')
+
+        outputFile.close()
+        inputFile.close()
+        return
+
+    if args.output and args.output != '-':
         try:
             outputFile = open(args.output, 'w+')
         except:
             print(f'Error opening output file: {args.output}'.format())
             exit(1)
     
-    if args.text:
+    if args.text is not None:
         inputText = args.text
 
         if args.verbose:
             print(f'Input Text: {inputText}'.format())
 
-        if args.latin:
-            outputText = SyrStrStrToIPA(inputText, dictionary)[1]
-        else:
-            outputText = SyrStrStrToIPA(inputText, dictionary)[0]
+        outputText = transliterator.transliterate(inputText)
 
         if outputFile is None:
             print(outputText)
@@ -557,7 +2595,7 @@ if __name__ == "__main__":
 
     elif args.file:
         try:
-            inputFile = open(args.file, 'r')
+            inputFile = OpenInput(args.file)
         except:
             print(f'Error opening input file: {args.file}'.format())
             exit(1)
@@ -566,13 +2604,10 @@ if __name__ == "__main__":
             if args.verbose:
                 print(f'Processing line from file: {line}'.format())
 
-            if args.latin:
-                outputText = SyrStrStrToIPA(line, dictionary)[1]
-            else:
-                outputText = SyrStrStrToIPA(line, dictionary)[0]
+            outputText = transliterator.transliterate(line)
             
             if outputFile is None:
-                print(outputText)
+                print(outputText, end='')
             else:
                 outputFile.write(outputText)
 
@@ -585,3 +2620,6 @@ if __name__ == "__main__":
 
     if inputFile:
         inputFile.close()
+
+if __name__ == "__main__":
+    main()